@@ -50,7 +50,7 @@ def static(request, path):
     print(f"請求靜態檔案: {full_path}")
     
     # send_file 會自動處理檔案不存在的情況 (回傳 404)
-    return send_file(full_path)
+    return send_file(full_path, request=request)
 
 # --- 主執行程式 ---
 def main():
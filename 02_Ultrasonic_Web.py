@@ -2,9 +2,11 @@ import network
 import time
 import json
 import asyncio
-from machine import Pin, time_pulse_us
+from machine import Pin
 from microdot import Microdot, send_file
-from microdot.websocket import with_websocket
+from microdot.websocket import with_websocket, WebSocketHub, WebSocketError
+from sampler import Sampler
+from ultrasonic import Ultrasonic
 
 # --- WiFi 連線設定 ---
 WIFI_SSID = 'HINET1'
@@ -17,9 +19,8 @@ ECHO_PIN = 13
 # 初始化 GPIO Pin
 trigger = Pin(TRIG_PIN, Pin.OUT)
 echo = Pin(ECHO_PIN, Pin.IN)
-
-# 全域變數，用於儲存上一次有效的距離
-last_distance = -1.0
+# 非阻塞超音波驅動程式：以腳位中斷記錄回波時間，等待期間不會卡住 asyncio
+ultrasonic = Ultrasonic(trigger, echo)
 
 # --- WiFi 連線函式 ---
 def connect_wifi(ssid, password):
@@ -35,31 +36,12 @@ def connect_wifi(ssid, password):
     print(f'網路已連接！ IP 地址: {ip_address}')
     return ip_address
 
-# --- 超音波感測器讀取函式 ---
-def get_distance():
-    """觸發超音波感測器並回傳距離 (cm)"""
-    # 觸發訊號
-    trigger.value(0)
-    time.sleep_us(2)
-    trigger.value(1)
-    time.sleep_us(10)
-    trigger.value(0)
-    
-    # 測量回波時間，設定 30000 微秒 (約 5 公尺) 的超時
-    try:
-        pulse_duration = time_pulse_us(echo, 1, 30000)
-    except OSError as e:
-        # 如果超時，time_pulse_us 可能會拋出 OSError
-        return -1.0
+# --- 感測器取樣器：所有連線共用同一份讀數，硬體只會被讀取一次 ---
+sampler = Sampler()
+sampler.add('distance', ultrasonic.distance, 100)
 
-    # 如果 pulse_duration 小於 0，表示超時
-    if pulse_duration < 0:
-        return -1.0
-        
-    # 計算距離 (音速約 343 m/s 或 29.1 us/cm)
-    # 距離 = (時間 * 音速) / 2 (因為是來回)
-    distance_cm = (pulse_duration / 2) / 29.1
-    return distance_cm
+# --- 廣播中心：每筆數據只編碼一次，再推送給所有訂閱的網頁 ---
+hub = WebSocketHub()
 
 # --- Microdot App 和路由設定 ---
 app = Microdot()
@@ -69,52 +51,52 @@ async def index(request):
     return send_file('web/index.html')
 
 # !!! 注意：WebSocket 路由必須定義在靜態檔案路由之前 !!!
-@app.route('/ws')
+@app.route('/ws', max_concurrency=4)  # 限制同時連線的 WebSocket 數量，避免記憶體不足
 @with_websocket
 async def ws_handler(request, ws):
-    """WebSocket 處理器，持續傳送感測器數據"""
-    global last_distance
+    """WebSocket 處理器，訂閱感測器數據的廣播"""
     print("WebSocket 客戶端已連接")
-    
-    while True:
-        try:
-            # 讀取距離
-            current_distance = get_distance()
-
-            # 如果讀取成功，更新 last_distance
-            # -1.0 代表讀取失敗 (例如超時)
-            if current_distance >= 0:
-                last_distance = current_distance
-            
-            # 準備 JSON 數據
-            payload = json.dumps({
-                'distance': last_distance
-            })
-
-            # 透過 WebSocket 傳送數據
-            await ws.send(payload)
-            
-            # 每秒傳送 10 次 (間隔 100ms)
-            await asyncio.sleep(0.1)
-
-        except Exception as e:
-            print(f"WebSocket 錯誤: {e}")
-            break # 當客戶端斷線或發生錯誤時，跳出迴圈
+    hub.subscribe(ws, 'telemetry')
+    try:
+        while True:
+            # 等待客戶端訊息，直到客戶端斷線
+            await ws.receive()
+    except (WebSocketError, OSError):
+        # 客戶端關閉網頁或網路中斷都屬於正常斷線，不需要顯示錯誤
+        pass
+    except Exception as e:
+        print(f"WebSocket 錯誤: {e}")
+    finally:
+        hub.unsubscribe(ws)
     
     print("WebSocket 客戶端已斷線")
 
+# --- 廣播任務：定期把感測器數據發佈給所有連線 ---
+async def telemetry():
+    while True:
+        # 從取樣器取得最近一次的有效距離 (尚未讀到時為 -1.0)
+        payload = json.dumps({
+            'distance': sampler.get('distance', -1.0)
+        })
+        hub.publish('telemetry', payload)
+        
+        # 每秒傳送 10 次 (間隔 100ms)
+        await asyncio.sleep(0.1)
+
 @app.route('/<path:path>')
 async def static(request, path):
     """靜態檔案伺服器"""
     if '..' in path:
         return "Path not allowed", 403
     full_path = 'web/' + path
-    return send_file(full_path)
+    return send_file(full_path, request=request)
 
 # --- 主執行程式 ---
 async def main():
     try:
         connect_wifi(WIFI_SSID, WIFI_PASSWORD)
+        sampler.start()  # 啟動感測器取樣任務
+        asyncio.create_task(telemetry())  # 啟動廣播任務
         
         print('啟動 Microdot 伺服器...')
         await app.start_server(port=80, debug=True)
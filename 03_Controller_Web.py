@@ -3,12 +3,14 @@
 # --- 模組導入 ---
 import network
 import time
-import json
 import asyncio
 import gc  # 導入記憶體回收模組
-from machine import Pin, ADC, time_pulse_us
+from machine import Pin, ADC
 from microdot import Microdot, send_file
 from microdot.websocket import with_websocket
+from sampler import Sampler
+from ultrasonic import Ultrasonic
+from telemetry import Telemetry, ChangeFilter
 
 # --- WiFi 連線設定 ---
 WIFI_SSID = 'HINET1'
@@ -25,16 +27,14 @@ POT_PIN_NUM = 39
 # 超音波
 trigger = Pin(TRIG_PIN_NUM, Pin.OUT)
 echo = Pin(ECHO_PIN_NUM, Pin.IN)
+# 非阻塞超音波驅動程式：以腳位中斷記錄回波時間，等待期間不會卡住 asyncio
+ultrasonic = Ultrasonic(trigger, echo)
 # 可變電阻 (ADC1_CH3)
 potentiometer = ADC(Pin(POT_PIN_NUM))
 # 設定衰減，讓 ADC 可以讀取 0-3.3V 的電壓
 # ADC.ATTN_11DB 對應約 0-3.3V 的輸入範圍
 potentiometer.atten(ADC.ATTN_11DB)
 
-# --- 全域變數，用於儲存上一次有效的感測器數值 ---
-last_valid_distance = -1.0
-last_valid_pot_value = -1
-
 # --- WiFi 連線函式 ---
 def connect_wifi(ssid, password):
     wlan = network.WLAN(network.STA_IF)
@@ -52,30 +52,22 @@ def connect_wifi(ssid, password):
     return ip_address
 
 # --- 感測器讀取函式 ---
-def get_distance():
-    """觸發超音波感測器並回傳距離 (cm)"""
-    trigger.value(0)
-    time.sleep_us(2)
-    trigger.value(1)
-    time.sleep_us(10)
-    trigger.value(0)
-    
-    try:
-        # 設定 30000 微秒 (約 5 公尺) 的超時
-        pulse_duration = time_pulse_us(echo, 1, 30000)
-    except OSError:
-        return -1.0
-
-    if pulse_duration < 0:
-        return -1.0
-        
-    distance_cm = (pulse_duration / 2) / 29.1
-    return distance_cm
-
 def get_pot_value():
     """讀取可變電阻的值 (0-4095)"""
     return potentiometer.read()
 
+# --- 感測器取樣器：所有連線共用同一份讀數，硬體只會被讀取一次 ---
+sampler = Sampler()
+sampler.add('distance', ultrasonic.distance, 100)
+sampler.add('potentiometer', get_pot_value, 100)
+
+# --- 遙測格式：距離為 32 位元浮點數，可變電阻為 16 位元有號整數 ---
+TELEMETRY_FIELDS = (('distance', 'f', -1.0), ('potentiometer', 'h', -1))
+# 變化偵測：距離變化超過 0.5 cm 或 1%、可變電阻變化超過 16 才傳送，
+# 數值在這個範圍 (死區) 內時略過傳送，但至少每秒傳送一次作為心跳，
+# 讓網頁知道連線仍然正常。每個連線各自建立一個 ChangeFilter
+DEADBANDS = (('distance', 0.5, 0.01), ('potentiometer', 16, 0))
+
 # --- Microdot App 和路由設定 ---
 app = Microdot()
 
@@ -84,33 +76,35 @@ async def index(request):
     return send_file('web/index.html')
 
 # 路由順序注意：WebSocket 路由需在靜態檔案路由之前
-@app.route('/ws')
+@app.route('/ws', max_concurrency=4)  # 限制同時連線的 WebSocket 數量，避免記憶體不足
 @with_websocket
 async def ws_handler(request, ws):
     """WebSocket 處理器，持續傳送所有感測器數據"""
-    global last_valid_distance, last_valid_pot_value
     print("WebSocket 客戶端已連接")
+
+    # 網頁以 /ws?format=binary 連線時傳送二進位數據，否則維持 JSON 格式
+    binary = request.args.get('format') == 'binary'
+    telemetry = Telemetry(TELEMETRY_FIELDS)
+    changes = ChangeFilter(DEADBANDS, heartbeat=1000)
+    if binary:
+        await ws.send(telemetry.schema())  # 先傳送欄位格式，供網頁解碼
+    # 傳送佇列：訊號不佳的客戶端跟不上時只保留最新一筆數據，傳送任務不會被卡住
+    # 只有 key 相同 (key='telemetry') 的數據會互相取代，其他訊息不會被丟棄
+    ws.enable_send_queue(2, 'coalesce-latest')
     
     while True:
         try:
-            # 讀取超音波距離
-            current_distance = get_distance()
-            if current_distance >= 0:
-                last_valid_distance = current_distance
-
-            # 讀取可變電阻值
-            last_valid_pot_value = get_pot_value()
-            
-            # 準備 JSON 數據，使用上一次的有效值
-            payload = json.dumps({
-                'distance': last_valid_distance,
-                'potentiometer': last_valid_pot_value
-            })
-
-            # 透過 WebSocket 傳送數據
-            await ws.send(payload)
+            # 透過 WebSocket 傳送取樣器中最近一次的有效值
+            if changes.check(sampler):
+                if binary:
+                    # 二進位格式：寫入重複使用的緩衝區，不必每次建立 dict 和字串
+                    await ws.send(telemetry.encode(sampler), ws.BINARY,
+                                  key='telemetry')
+                else:
+                    await ws.send(telemetry.encode_json(sampler),
+                                  key='telemetry')
             
-            # 每秒傳送 10 次 (間隔 100ms)
+            # 每 100ms 檢查一次 (最多每秒傳送 10 次)
             await asyncio.sleep_ms(100)
 
         except Exception as e:
@@ -125,7 +119,7 @@ async def static(request, path):
     if '..' in path:
         return "Path not allowed", 403
     full_path = 'web/' + path
-    return send_file(full_path)
+    return send_file(full_path, request=request)
 
 # --- 記憶體回收任務 ---
 async def garbage_collector():
@@ -143,6 +137,7 @@ async def main():
         
         # 啟動記憶體回收任務
         asyncio.create_task(garbage_collector())
+        sampler.start()  # 啟動感測器取樣任務
         
         print('啟動 Microdot 伺服器...')
         # 關閉除錯模式以獲得更好效能
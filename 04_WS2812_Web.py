@@ -3,13 +3,17 @@
 # --- 模組導入 ---
 import network
 import time
-import json
 import asyncio
 import gc  # 導入記憶體回收模組
-from machine import Pin, ADC, time_pulse_us
+from machine import Pin, ADC
 from neopixel import NeoPixel  # <--- 新增
 from microdot import Microdot, send_file
 from microdot.websocket import with_websocket
+from sampler import Sampler
+from ultrasonic import Ultrasonic
+from telemetry import Telemetry, ChangeFilter
+from coalescer import Coalescer
+from commands import CommandRouter, Int, Color
 
 # --- WiFi 連線設定 ---
 WIFI_SSID = 'HINET1'
@@ -29,6 +33,8 @@ NUM_LEDS = 2     # <--- 新增
 # 超音波
 trigger = Pin(TRIG_PIN_NUM, Pin.OUT)
 echo = Pin(ECHO_PIN_NUM, Pin.IN)
+# 非阻塞超音波驅動程式：以腳位中斷記錄回波時間，等待期間不會卡住 asyncio
+ultrasonic = Ultrasonic(trigger, echo)
 # 可變電阻 (ADC1_CH3)
 potentiometer = ADC(Pin(POT_PIN_NUM))
 # 設定衰減，讓 ADC 可以讀取 0-3.3V 的電壓
@@ -37,10 +43,6 @@ potentiometer.atten(ADC.ATTN_11DB)
 # WS2812 LED
 np = NeoPixel(Pin(NEO_PIN_NUM), NUM_LEDS) # <--- 新增
 
-# --- 全域變數，用於儲存上一次有效的感測器數值 ---
-last_valid_distance = -1.0
-last_valid_pot_value = -1
-
 # --- WiFi 連線函式 ---
 def connect_wifi(ssid, password):
     wlan = network.WLAN(network.STA_IF)
@@ -58,30 +60,38 @@ def connect_wifi(ssid, password):
     return ip_address
 
 # --- 感測器讀取函式 ---
-def get_distance():
-    """觸發超音波感測器並回傳距離 (cm)"""
-    trigger.value(0)
-    time.sleep_us(2)
-    trigger.value(1)
-    time.sleep_us(10)
-    trigger.value(0)
-    
-    try:
-        pulse_duration = time_pulse_us(echo, 1, 30000)
-    except OSError:
-        return -1.0
-
-    if pulse_duration < 0:
-        return -1.0
-        
-    distance_cm = (pulse_duration / 2) / 29.1
-    return distance_cm
-
 def get_pot_value():
     """讀取可變電阻的值 (0-4095)"""
     # ESP32 的 ADC 是 12-bit，最大值為 4095
     return potentiometer.read()
 
+# --- 感測器取樣器：所有連線共用同一份讀數，硬體只會被讀取一次 ---
+sampler = Sampler()
+sampler.add('distance', ultrasonic.distance, 100)
+sampler.add('potentiometer', get_pot_value, 100)
+
+# --- 遙測格式：距離為 32 位元浮點數，可變電阻為 16 位元有號整數 ---
+TELEMETRY_FIELDS = (('distance', 'f', -1.0), ('potentiometer', 'h', -1))
+# 變化偵測門檻 (說明見 03_Controller_Web.py)
+DEADBANDS = (('distance', 0.5, 0.01), ('potentiometer', 16, 0))
+
+# --- 致動器指令合併：只保留每個目標最新的指令，最多每 50ms 更新一次硬體 ---
+def apply_actuators(updates):
+    """套用累積的 LED 指令，所有 LED 設定完成後只寫入一次"""
+    for led_index, color in updates.items():
+        np[led_index] = color
+    np.write()
+
+actuators = Coalescer(apply_actuators, interval=50)
+
+# --- WebSocket 指令路由表：每個指令登記一次欄位驗證器，收到訊息時以字典查詢分派 ---
+commands = CommandRouter()
+
+@commands.command('led', ('led', Int(0, NUM_LEDS - 1)), ('color', Color()))
+def set_led(led_index, color):
+    # 只記錄最新的顏色，由合併任務寫入 LED
+    actuators.put(led_index, color)
+
 # --- Microdot App 和路由設定 ---
 app = Microdot()
 
@@ -90,54 +100,42 @@ async def index(request):
     return send_file('web/index.html')
 
 # 路由順序注意：WebSocket 路由需在靜態檔案路由之前
-@app.route('/ws')
+@app.route('/ws', max_concurrency=4)  # 限制同時連線的 WebSocket 數量，避免記憶體不足
 @with_websocket
 async def ws_handler(request, ws):
     """WebSocket 處理器，非同步處理感測器數據傳送和 LED 控制接收"""
-    global last_valid_distance, last_valid_pot_value
     print("WebSocket 客戶端已連接")
 
+    # 網頁以 /ws?format=binary 連線時傳送二進位數據，否則維持 JSON 格式
+    binary = request.args.get('format') == 'binary'
+    telemetry = Telemetry(TELEMETRY_FIELDS)
+    changes = ChangeFilter(DEADBANDS, heartbeat=1000)
+    if binary:
+        await ws.send(telemetry.schema())  # 先傳送欄位格式，供網頁解碼
+    # 傳送佇列：訊號不佳的客戶端跟不上時只保留最新一筆數據，傳送任務不會被卡住
+    ws.enable_send_queue(2, 'coalesce-latest')
+
     # --- 非同步任務：定期傳送感測器數據 ---
     async def sender():
         while True:
-            # 讀取超音波距離
-            current_distance = get_distance()
-            if current_distance >= 0:
-                last_valid_distance = current_distance
-
-            # 讀取可變電阻值
-            last_valid_pot_value = get_pot_value()
-            
-            # 準備 JSON 數據
-            payload = json.dumps({
-                'distance': last_valid_distance,
-                'potentiometer': last_valid_pot_value
-            })
-
-            await ws.send(payload)
-            await asyncio.sleep_ms(100) # 每秒傳送 10 次
+            # 使用取樣器中最近一次的有效值
+            if changes.check(sampler):
+                if binary:
+                    # 二進位格式：寫入重複使用的緩衝區，不必每次建立 dict 和字串
+                    await ws.send(telemetry.encode(sampler), ws.BINARY,
+                                  key='telemetry')
+                else:
+                    await ws.send(telemetry.encode_json(sampler),
+                                  key='telemetry')
+            await asyncio.sleep_ms(100) # 最多每秒傳送 10 次
 
     # --- 非同步任務：接收來自客戶端的指令 ---
     async def receiver():
         while True:
             msg = await ws.receive()
-            try:
-                data = json.loads(msg)
-                if 'led' in data and 'color' in data:
-                    led_index = data['led']
-                    color_hex = data['color']
-                    # 將 #RRGGBB 格式的顏色轉換為 (r, g, b) 元組
-                    r = int(color_hex[1:3], 16)
-                    g = int(color_hex[3:5], 16)
-                    b = int(color_hex[5:7], 16)
-                    
-                    if 0 <= led_index < NUM_LEDS:
-                        np[led_index] = (r, g, b)
-                        np.write()
-                        print(f"設定 LED {led_index} 顏色為 ({r}, {g}, {b})")
-
-            except (TypeError, ValueError) as e:
-                print(f"收到的 WebSocket 訊息無效: {msg}, 錯誤: {e}")
+            # 由指令路由表驗證並分派，格式錯誤的訊息在呼叫處理函式前就會被拒絕
+            if not await commands.dispatch(msg):
+                print(f"收到的 WebSocket 訊息無效: {msg}, 錯誤: {commands.last_error}")
 
     # 建立並執行 sender 和 receiver 任務
     sender_task = asyncio.create_task(sender())
@@ -161,7 +159,7 @@ async def static(request, path):
     if '..' in path:
         return "Path not allowed", 403
     full_path = 'web/' + path
-    return send_file(full_path)
+    return send_file(full_path, request=request)
 
 # --- 記憶體回收任務 ---
 async def garbage_collector():
@@ -182,6 +180,8 @@ async def main():
 
         # 啟動記憶體回收任務
         asyncio.create_task(garbage_collector())
+        sampler.start()  # 啟動感測器取樣任務
+        actuators.start()  # 啟動致動器指令合併任務
         
         print('啟動 Microdot 伺服器...')
         await app.start_server(port=80, debug=False)
@@ -3,13 +3,17 @@
 # --- 模組導入 ---
 import network
 import time
-import json
 import asyncio
 import gc
-from machine import Pin, ADC, time_pulse_us
+from machine import Pin, ADC
 from neopixel import NeoPixel
 from microdot import Microdot, send_file
 from microdot.websocket import with_websocket
+from sampler import Sampler
+from ultrasonic import Ultrasonic
+from telemetry import Telemetry, ChangeFilter
+from coalescer import Coalescer
+from commands import CommandRouter, Color
 
 # --- WiFi 連線設定 ---
 WIFI_SSID = 'HINET1'
@@ -25,14 +29,12 @@ NUM_LEDS = 2
 # --- 初始化 GPIO、ADC 和 NeoPixel ---
 trigger = Pin(TRIG_PIN_NUM, Pin.OUT)
 echo = Pin(ECHO_PIN_NUM, Pin.IN)
+# 非阻塞超音波驅動程式：以腳位中斷記錄回波時間，等待期間不會卡住 asyncio
+ultrasonic = Ultrasonic(trigger, echo)
 potentiometer = ADC(Pin(POT_PIN_NUM))
 potentiometer.atten(ADC.ATTN_11DB)
 np = NeoPixel(Pin(NEO_PIN_NUM), NUM_LEDS)
 
-# --- 全域變數 ---
-last_valid_distance = -1.0
-last_valid_pot_value = -1
-
 # --- WiFi 連線函式 ---
 def connect_wifi(ssid, password):
     wlan = network.WLAN(network.STA_IF)
@@ -48,21 +50,36 @@ def connect_wifi(ssid, password):
     return ip_address
 
 # --- 感測器讀取函式 ---
-def get_distance():
-    trigger.value(0)
-    time.sleep_us(2)
-    trigger.value(1)
-    time.sleep_us(10)
-    trigger.value(0)
-    try:
-        pulse_duration = time_pulse_us(echo, 1, 30000)
-    except OSError:
-        return -1.0
-    return (pulse_duration / 2) / 29.1 if pulse_duration > 0 else -1.0
-
 def get_pot_value():
     return potentiometer.read()
 
+# --- 感測器取樣器：所有連線共用同一份讀數，硬體只會被讀取一次 ---
+sampler = Sampler()
+# 超音波量測要等待回波 (最多約 35ms)，放在自己的任務中讀取，才不會延遲控制球拍的可變電阻
+sampler.add('distance', ultrasonic.distance, 30, own_task=True)
+sampler.add('potentiometer', get_pot_value, 30)
+
+# --- 遙測格式：距離為 32 位元浮點數，可變電阻為 16 位元有號整數 ---
+TELEMETRY_FIELDS = (('distance', 'f', -1.0), ('potentiometer', 'h', -1))
+# 變化偵測門檻 (說明見 03_Controller_Web.py)
+DEADBANDS = (('distance', 0.5, 0.01), ('potentiometer', 16, 0))
+
+# --- 致動器指令合併：只保留每個目標最新的指令，最多每 50ms 更新一次硬體 ---
+def apply_actuators(updates):
+    """將兩顆 LED 設為最新的顏色"""
+    np.fill(updates['fill'])
+    np.write()
+
+actuators = Coalescer(apply_actuators, interval=50)
+
+# --- WebSocket 指令路由表：每個指令登記一次欄位驗證器，收到訊息時以字典查詢分派 ---
+commands = CommandRouter()
+
+@commands.command('brick_color', ('brick_color', Color()))
+def set_brick_color(color):
+    # 將兩顆 LED 設為被擊中磚塊的顏色，由合併任務寫入 LED
+    actuators.put('fill', color)
+
 # --- Microdot App 和路由設定 ---
 app = Microdot()
 
@@ -70,46 +87,40 @@ app = Microdot()
 async def index(request):
     return send_file('web/index.html')
 
-@app.route('/ws')
+@app.route('/ws', max_concurrency=4)  # 限制同時連線的 WebSocket 數量，避免記憶體不足
 @with_websocket
 async def ws_handler(request, ws):
-    global last_valid_distance, last_valid_pot_value
     print("WebSocket 客戶端已連接")
 
+    # 網頁以 /ws?format=binary 連線時傳送二進位數據，否則維持 JSON 格式
+    binary = request.args.get('format') == 'binary'
+    telemetry = Telemetry(TELEMETRY_FIELDS)
+    changes = ChangeFilter(DEADBANDS, heartbeat=1000)
+    if binary:
+        await ws.send(telemetry.schema())  # 先傳送欄位格式，供網頁解碼
+    # 傳送佇列：訊號不佳的客戶端跟不上時只保留最新一筆數據，傳送任務不會被卡住
+    ws.enable_send_queue(2, 'coalesce-latest')
+
     async def sender():
         """定期將可變電阻和超音波數據傳送給網頁"""
         while True:
-            current_distance = get_distance()
-            if current_distance >= 0:
-                last_valid_distance = current_distance
-            
-            last_valid_pot_value = get_pot_value()
-            
-            payload = json.dumps({
-                'distance': last_valid_distance,
-                'potentiometer': last_valid_pot_value
-            })
-            await ws.send(payload)
+            if changes.check(sampler):
+                if binary:
+                    # 二進位格式：寫入重複使用的緩衝區，不必每次建立 dict 和字串
+                    await ws.send(telemetry.encode(sampler), ws.BINARY,
+                                  key='telemetry')
+                else:
+                    await ws.send(telemetry.encode_json(sampler),
+                                  key='telemetry')
             await asyncio.sleep_ms(30) # 提高更新頻率以獲得流暢的遊戲控制
 
     async def receiver():
         """接收來自網頁的指令，主要是被擊中磚塊的顏色"""
         while True:
             msg = await ws.receive()
-            try:
-                data = json.loads(msg)
-                if 'brick_color' in data:
-                    color_hex = data['brick_color']
-                    r = int(color_hex[1:3], 16)
-                    g = int(color_hex[3:5], 16)
-                    b = int(color_hex[5:7], 16)
-                    
-                    # 將兩顆 LED 設為相同顏色
-                    np.fill((r, g, b))
-                    np.write()
-                    
-            except (TypeError, ValueError, KeyError) as e:
-                print(f"收到的 WebSocket 訊息無效: {msg}, 錯誤: {e}")
+            # 由指令路由表驗證並分派，格式錯誤的訊息在呼叫處理函式前就會被拒絕
+            if not await commands.dispatch(msg):
+                print(f"收到的 WebSocket 訊息無效: {msg}, 錯誤: {commands.last_error}")
 
     sender_task = asyncio.create_task(sender())
     receiver_task = asyncio.create_task(receiver())
@@ -125,7 +136,7 @@ async def ws_handler(request, ws):
 @app.route('/<path:path>')
 async def static(request, path):
     if '..' in path: return "Path not allowed", 403
-    return send_file('web/' + path)
+    return send_file('web/' + path, request=request)
 
 async def garbage_collector():
     while True:
@@ -141,6 +152,8 @@ async def main():
         np.write()
 
         asyncio.create_task(garbage_collector())
+        sampler.start()  # 啟動感測器取樣任務
+        actuators.start()  # 啟動致動器指令合併任務
         
         print('啟動 Microdot 伺服器...')
         await app.start_server(port=80, debug=False)
@@ -0,0 +1,82 @@
+"""Telemetry change filter benchmark.
+
+Simulates one minute of readings from a noisy ultrasonic sensor and a
+potentiometer that is turned now and then, checked every 100 ms as in the
+examples, and reports how many messages are sent with and without the
+``ChangeFilter`` deadbands, and the time taken by each check. The clock of
+the ``telemetry`` module is replaced with a simulated one, so the benchmark
+does not need to run in real time.
+
+Run from the root of the repository with
+``python benchmarks/bench_change_filter.py``.
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+
+import telemetry  # noqa: E402
+from telemetry import ChangeFilter  # noqa: E402
+
+DURATION_MS = 60000
+INTERVAL_MS = 100
+CONFIGURATIONS = (
+    # (name, fields, heartbeat, min_interval)
+    ('every tick', (('distance', 0, 0), ('potentiometer', 0, 0)), 0, 0),
+    ('deadband', (('distance', 0.5, 0.01), ('potentiometer', 16, 0)),
+     1000, 0),
+    ('deadband+cap', (('distance', 0.5, 0.01), ('potentiometer', 16, 0)),
+     1000, 250),
+)
+
+
+def now():
+    if hasattr(time, 'ticks_us'):  # pragma: no cover
+        return time.ticks_us() / 1000000
+    return time.perf_counter()
+
+
+def readings():
+    random.seed(1)
+    distance = 80.0
+    potentiometer = 2000
+    result = []
+    for i in range(DURATION_MS // INTERVAL_MS):
+        if i % 150 < 20:
+            # someone walks towards the sensor and turns the knob
+            distance = max(5.0, distance - 2.0)
+            potentiometer = min(4095, potentiometer + 60)
+        elif i % 150 == 20:
+            distance = 80.0
+        result.append({
+            'distance': round(distance + random.uniform(-0.3, 0.3), 1),
+            'potentiometer': potentiometer + random.randint(-8, 8),
+        })
+    return result
+
+
+def main():
+    data = readings()
+    clock = [0]
+    telemetry.ticks_ms = lambda: clock[0]
+    print('{:<14} {:>6} {:>11} {:>10}'.format('config', 'sent', 'suppressed',
+                                              'us/check'))
+    for name, fields, heartbeat, min_interval in CONFIGURATIONS:
+        changes = ChangeFilter(fields, heartbeat=heartbeat,
+                               min_interval=min_interval)
+        clock[0] = 0
+        elapsed = 0
+        for values in data:
+            start = now()
+            changes.check(values)
+            elapsed += now() - start
+            clock[0] += INTERVAL_MS
+        print('{:<14} {:>6} {:>11} {:>10.2f}'.format(
+            name, changes.sent, changes.suppressed,
+            elapsed / len(data) * 1000000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Actuator command coalescing benchmark.
+
+Floods a receiver with slider commands, one every millisecond, as a web page
+does while a slider is dragged, and drives a simulated actuator that blocks
+for a fixed time on each update, like ``np.write()`` or a servo update.
+The commands are either applied one by one in the order they arrive, as the
+examples used to do, or merged by a ``Coalescer``. For each approach, the
+number of actuator updates, the average and longest time between sending a
+command and applying its value, and the time it takes to apply the final
+position after the flood ends are reported.
+
+Run from the root of the repository with
+``python benchmarks/bench_coalescer.py``.
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+
+from coalescer import Coalescer  # noqa: E402
+
+COMMANDS = 1000
+SEND_INTERVAL = 0.001  # seconds between commands
+ACTUATOR_US = 2000  # time the actuator blocks on each update
+INTERVAL_MS = 50  # coalescer update interval
+
+
+def now():
+    if hasattr(time, 'ticks_us'):  # pragma: no cover
+        return time.ticks_us() / 1000000
+    return time.perf_counter()
+
+
+class Actuator:
+    def __init__(self):
+        self.updates = 0
+        self.latencies = []
+        self.final = None
+
+    def apply(self, sent, last):
+        start = now()
+        while now() - start < ACTUATOR_US / 1000000:
+            pass
+        self.updates += 1
+        self.latencies.append(now() - sent)
+        if last:
+            self.final = now()
+
+
+class Inbox:
+    """Commands sent at a fixed rate, which the socket buffers while the
+    receiver is busy."""
+    def __init__(self):
+        self.start = now()
+        self.end = self.start + (COMMANDS - 1) * SEND_INTERVAL
+        self.count = 0
+
+    async def get(self):
+        if self.count == COMMANDS:
+            await asyncio.sleep(3600)
+        sent = self.start + self.count * SEND_INTERVAL
+        delay = sent - now()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self.count += 1
+        # the command carries the time it was sent
+        return sent, self.count == COMMANDS
+
+
+async def measure(name, receive):
+    inbox = Inbox()
+    actuator = Actuator()
+    task = asyncio.create_task(receive(inbox, actuator))
+    while actuator.final is None:
+        await asyncio.sleep(0.001)
+    task.cancel()
+    latencies = actuator.latencies
+    print('{:<10} {:>8} {:>12.1f} {:>12.1f} {:>12.1f}'.format(
+        name, actuator.updates,
+        sum(latencies) / len(latencies) * 1000, max(latencies) * 1000,
+        (actuator.final - inbox.end) * 1000))
+
+
+async def direct(inbox, actuator):
+    while True:
+        sent, last = await inbox.get()
+        actuator.apply(sent, last)
+
+
+async def coalesced(inbox, actuator):
+    def apply(updates):
+        actuator.apply(*updates['servo'])
+
+    coalescer = Coalescer(apply, interval=INTERVAL_MS)
+    coalescer.start()
+    try:
+        while True:
+            command = await inbox.get()
+            coalescer.put('servo', command)
+    finally:
+        coalescer.stop()
+
+
+async def main():
+    print('{:<10} {:>8} {:>12} {:>12} {:>12}'.format(
+        'method', 'updates', 'avg lat ms', 'max lat ms', 'settle ms'))
+    await measure('direct', direct)
+    await measure('coalesced', coalesced)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,99 @@
+"""WebSocket command dispatch benchmark.
+
+Handles the command messages sent by the example pages, and compares the
+original ``if ... elif`` chain of the receivers, which parses and converts
+the arguments inline, with a ``CommandRouter``. Each approach is measured
+with the two commands of the examples and with 20 commands, where the
+commands being sent are the last ones of the chain, and with malformed
+messages. The time per message is reported.
+
+Run from the root of the repository with
+``python benchmarks/bench_commands.py``.
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+
+from commands import CommandRouter, Color, Float, Int  # noqa: E402
+
+ITERATIONS = 20000
+VALID = ('{"led": 1, "color": "#ff8000"}', '{"servo": 0.5}')
+MALFORMED = ('x' * 1000, 'not json', '{"led": 5, "color": "#ff8000"}',
+             '{"servo": "fast"}')
+
+
+def now():
+    if hasattr(time, 'ticks_us'):  # pragma: no cover
+        return time.ticks_us() / 1000000
+    return time.perf_counter()
+
+
+def handle(*args):
+    pass
+
+
+def chain_receiver(extra):
+    """Build an if/elif receiver like the examples, with ``extra`` commands
+    checked before the two real ones."""
+    def receive(msg):
+        try:
+            data = json.loads(msg)
+            for key in extra:
+                if key in data:
+                    handle(data[key])
+                    return
+            if 'led' in data and 'color' in data:
+                led_index = data['led']
+                color_hex = data['color']
+                r = int(color_hex[1:3], 16)
+                g = int(color_hex[3:5], 16)
+                b = int(color_hex[5:7], 16)
+                if 0 <= led_index < 2:
+                    handle(led_index, (r, g, b))
+            elif 'servo' in data:
+                value = float(data['servo'])
+                if 0.0 <= value <= 1.0:
+                    handle(value)
+        except (TypeError, ValueError, KeyError):
+            pass
+    return receive
+
+
+def router_receiver(extra):
+    router = CommandRouter()
+    for key in extra:
+        router.add(key, handle, (key, Int()))
+    router.add('led', handle, ('led', Int(0, 1)), ('color', Color()))
+    router.add('servo', handle, ('servo', Float(0.0, 1.0)))
+    return router.dispatch
+
+
+async def measure(receive, messages):
+    start = now()
+    for _ in range(ITERATIONS):
+        for msg in messages:
+            result = receive(msg)
+            if hasattr(result, 'send'):
+                await result
+    return (now() - start) / (ITERATIONS * len(messages)) * 1000000
+
+
+async def main():
+    print('{:<8} {:>9} {:>12} {:>14}'.format('method', 'commands',
+                                             'valid us', 'malformed us'))
+    for count in (2, 20):
+        extra = ['command{}'.format(i) for i in range(count - 2)]
+        for name, build in (('if/elif', chain_receiver),
+                            ('router', router_receiver)):
+            receive = build(extra)
+            print('{:<8} {:>9} {:>12.2f} {:>14.2f}'.format(
+                name, count, await measure(receive, VALID),
+                await measure(receive, MALFORMED)))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
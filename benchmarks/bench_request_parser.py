@@ -0,0 +1,69 @@
+"""Request parser benchmark.
+
+Compares the number of requests per second that can be parsed by the line by
+line request parser and by the buffered parser enabled with
+``Request.buffered_parser``, using browser-like requests fed through an
+asyncio stream reader.
+
+Run from the root of the repository with
+``python benchmarks/bench_request_parser.py``.
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+
+from microdot import Microdot, Request  # noqa: E402
+from microdot.microdot import BufferedStream  # noqa: E402
+
+REQUESTS = 5000
+
+REQUEST = (
+    b'GET /06.html HTTP/1.1\r\n'
+    b'Host: 192.168.1.50\r\n'
+    b'Connection: keep-alive\r\n'
+    b'Cache-Control: max-age=0\r\n'
+    b'Upgrade-Insecure-Requests: 1\r\n'
+    b'User-Agent: Mozilla/5.0 (Linux; Android 14) AppleWebKit/537.36 '
+    b'(KHTML, like Gecko) Chrome/126.0 Mobile Safari/537.36\r\n'
+    b'Accept: text/html,application/xhtml+xml,application/xml;q=0.9,'
+    b'image/avif,image/webp,*/*;q=0.8\r\n'
+    b'Accept-Encoding: gzip, deflate\r\n'
+    b'Accept-Language: zh-TW,zh;q=0.9,en-US;q=0.8,en;q=0.7\r\n'
+    b'\r\n'
+)
+
+
+async def parse_requests(app, buffered, access_headers):
+    Request.buffered_parser = buffered
+    reader = asyncio.StreamReader()
+    reader.feed_data(REQUEST * REQUESTS)
+    reader.feed_eof()
+    if buffered:
+        # the server wraps each connection's stream once
+        reader = BufferedStream(reader)
+    start = time.perf_counter()
+    for _ in range(REQUESTS):
+        req = await Request.create(app, reader, None, ('127.0.0.1', 1234))
+        if access_headers:
+            req.headers['Accept-Encoding']
+    return REQUESTS / (time.perf_counter() - start)
+
+
+async def main():
+    app = Microdot()
+    print('{:<34} {:>12}'.format('parser', 'requests/s'))
+    for access_headers in (False, True):
+        for buffered in (False, True):
+            rate = await parse_requests(app, buffered, access_headers)
+            print('{:<34} {:>12.0f}'.format(
+                '{}{}'.format('buffered' if buffered else 'line by line',
+                              ', headers accessed' if access_headers
+                              else ''), rate))
+    Request.buffered_parser = False
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,87 @@
+"""Route dispatch benchmark.
+
+Compares the time it takes to find a route with a linear scan of the URL map
+against the segment tree used by ``Microdot.find_route``, for applications
+with 10, 100 and 1000 routes.
+
+Run from the root of the repository with
+``python benchmarks/bench_routing.py``.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+
+from microdot import Microdot  # noqa: E402
+
+ROUTE_COUNTS = (10, 100, 1000)
+LOOKUPS = 2000
+
+
+class FakeRequest:
+    def __init__(self, method, path):
+        self.method = method
+        self.path = path
+
+
+def linear_find_route(app, req):
+    f = 404
+    for route_methods, route_pattern, route_handler, _, _ in app.url_map:
+        req.url_args = route_pattern.match(req.path)
+        if req.url_args is not None:
+            if req.method in route_methods:
+                f = route_handler
+                break
+            else:
+                f = 405
+    return f
+
+
+def handler(request, **kwargs):
+    pass
+
+
+def make_app(count):
+    app = Microdot()
+    api = Microdot()
+    for i in range(count // 2):
+        app.route('/page{}'.format(i))(handler)
+        api.route('/items{}/<int:id>'.format(i), methods=['GET', 'PUT'])(
+            handler)
+    app.mount(api, url_prefix='/api')
+    app.route('/<path:path>')(handler)
+    return app
+
+
+def make_requests(count):
+    reqs = []
+    for i in range(0, count // 2, max(1, count // 20)):
+        reqs.append(FakeRequest('GET', '/page{}'.format(i)))
+        reqs.append(FakeRequest('PUT', '/api/items{}/{}'.format(i, i * 7)))
+        reqs.append(FakeRequest('GET', '/static/img{}.png'.format(i)))
+    return reqs
+
+
+def timeit(find, app, reqs):
+    start = time.perf_counter()
+    for i in range(LOOKUPS):
+        find(app, reqs[i % len(reqs)])
+    return (time.perf_counter() - start) * 1e6 / LOOKUPS
+
+
+def main():
+    print('{:>7} {:>14} {:>14} {:>8}'.format(
+        'routes', 'linear (us)', 'indexed (us)', 'speedup'))
+    for count in ROUTE_COUNTS:
+        app = make_app(count)
+        reqs = make_requests(count)
+        app.get_route_index()  # build the index outside of the timed loop
+        linear = timeit(linear_find_route, app, reqs)
+        indexed = timeit(lambda app, req: app.find_route(req), app, reqs)
+        print('{:>7} {:>14.1f} {:>14.1f} {:>7.1f}x'.format(
+            len(app.url_map), linear, indexed, linear / indexed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""File body allocation benchmark.
+
+Sends ``web/Robot.png`` through ``Response.write`` repeatedly, comparing the
+original path that reads a new bytes object for every chunk with the
+``readinto`` path that reuses a buffer for the connection. For each path, the
+number of chunk buffers allocated and writes issued per response are
+reported, along with the time per response. When running under MicroPython,
+the number of heap bytes allocated per response is reported as well.
+
+Run from the root of the repository with
+``python benchmarks/bench_send_file.py``.
+"""
+import asyncio
+import gc
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+
+from microdot import Response  # noqa: E402
+from microdot.microdot import LazyFile  # noqa: E402
+
+FILENAME = os.path.join(os.path.dirname(__file__), '..', 'web', 'Robot.png')
+RESPONSES = 200
+
+
+def now_us():
+    if hasattr(time, 'ticks_us'):  # pragma: no cover
+        return time.ticks_us()
+    return time.perf_counter() * 1e6
+
+
+class CountingStream:
+    """A connection that discards the data written to it, but remembers the
+    distinct buffers it received."""
+    def __init__(self):
+        self.buffers = []
+        self.size = 0
+
+    async def awrite(self, data):
+        self.size += len(data)
+        self.buffers.append(data.obj if isinstance(data, memoryview)
+                            else data)
+
+    def allocations(self):
+        return len(set(id(buf) for buf in self.buffers))
+
+
+class ReadOnlyFile:
+    """A file without ``readinto``, which forces the original chunked read
+    path."""
+    def __init__(self, filename):
+        self.f = LazyFile(filename)
+
+    def read(self, n=-1):
+        return self.f.read(n)
+
+    def close(self):
+        self.f.close()
+
+
+async def run(make_body):
+    stream = CountingStream()
+    heap = None
+    if hasattr(gc, 'mem_alloc'):  # pragma: no cover
+        gc.collect()
+        gc.disable()
+        heap = gc.mem_alloc()
+    start = now_us()
+    writes = 0
+    for _ in range(RESPONSES):
+        res = Response(body=make_body())
+        res.headers['Content-Length'] = str(os.stat(FILENAME)[6])
+        await res.write(stream)
+        writes += res.write_count - 1  # exclude the headers
+    elapsed = now_us() - start
+    if heap is not None:  # pragma: no cover
+        heap = (gc.mem_alloc() - heap) // RESPONSES
+        gc.enable()
+    # the first write of each response is the status line and headers
+    allocations = stream.allocations() - RESPONSES
+    return (allocations / RESPONSES, writes / RESPONSES,
+            elapsed / RESPONSES, heap)
+
+
+async def main():
+    print('{:<10} {:>13} {:>13} {:>13} {:>13}'.format(
+        'path', 'allocs/resp', 'writes/resp', 'us/resp', 'heap B/resp'))
+    for name, make_body in (('read', lambda: ReadOnlyFile(FILENAME)),
+                            ('readinto', lambda: LazyFile(FILENAME))):
+        allocs, writes, us, heap = await run(make_body)
+        print('{:<10} {:>13.2f} {:>13.1f} {:>13.0f} {:>13}'.format(
+            name, allocs, writes, us, '-' if heap is None else heap))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
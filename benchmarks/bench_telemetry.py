@@ -0,0 +1,68 @@
+"""Telemetry encoding benchmark.
+
+Encodes the sensor readings sent by the examples, and compares the original
+``json.dumps()`` of a new dictionary with the binary messages of the
+``Telemetry`` class, which are packed into a reused buffer, and with its
+JSON fallback. For each method, the size of the WebSocket frame and the
+time to encode the message and the frame are reported.
+
+Run from the root of the repository with
+``python benchmarks/bench_telemetry.py``.
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+
+from microdot.websocket import WebSocket  # noqa: E402
+from sampler import Sampler  # noqa: E402
+from telemetry import Telemetry  # noqa: E402
+
+MESSAGES = 20000
+FIELDS = (('distance', 'f', -1.0), ('potentiometer', 'h', -1))
+
+
+def now():
+    if hasattr(time, 'ticks_us'):  # pragma: no cover
+        return time.ticks_us() / 1000000
+    return time.perf_counter()
+
+
+def main():
+    sampler = Sampler()
+    sampler.add('distance', lambda: 123.45, 100)
+    sampler.add('potentiometer', lambda: 2048, 100)
+    for sensor in sampler.sensors.values():
+        sensor.value = sensor.read()
+    telemetry = Telemetry(FIELDS)
+
+    def dict_json():
+        return WebSocket._encode_websocket_frame(WebSocket.TEXT, json.dumps({
+            'distance': sampler.get('distance', -1.0),
+            'potentiometer': sampler.get('potentiometer', -1),
+        }))
+
+    def telemetry_json():
+        return WebSocket._encode_websocket_frame(
+            WebSocket.TEXT, telemetry.encode_json(sampler))
+
+    def telemetry_binary():
+        return WebSocket._encode_websocket_frame(
+            WebSocket.BINARY, telemetry.encode(sampler))
+
+    print('{:<18} {:>12} {:>10}'.format('method', 'frame bytes', 'us/msg'))
+    for name, encode in (('json.dumps(dict)', dict_json),
+                         ('telemetry json', telemetry_json),
+                         ('telemetry binary', telemetry_binary)):
+        start = now()
+        for _ in range(MESSAGES):
+            frame = encode()
+        elapsed = now() - start
+        print('{:<18} {:>12} {:>10.2f}'.format(
+            name, len(frame), elapsed / MESSAGES * 1000000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Ultrasonic ranging benchmark.
+
+Takes readings from a simulated sensor while a heartbeat task tries to run
+every millisecond, and compares the blocking ``time_pulse_us()`` approach
+used by the examples with the interrupt-driven ``Ultrasonic`` driver. The
+blocking reading is simulated by busy-waiting for the length of the echo
+pulse, which is what ``time_pulse_us()`` does. For each approach, the time
+per reading, the number of heartbeats that ran and the longest gap between
+heartbeats are reported.
+
+Run from the root of the repository with
+``python benchmarks/bench_ultrasonic.py``.
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+
+from ultrasonic import Ultrasonic, SimulatedSensor  # noqa: E402
+
+DISTANCES = (20, 100, 250, None)  # None simulates a missing echo
+READINGS = 40
+TIMEOUT_US = 30000
+
+
+def now_us():
+    if hasattr(time, 'ticks_us'):  # pragma: no cover
+        return time.ticks_us()
+    return time.perf_counter() * 1e6
+
+
+def blocking_distance(distance):
+    """Simulate ``get_distance()``: block for the echo delay and pulse."""
+    start = now_us()
+    pulse = TIMEOUT_US if distance is None \
+        else 450 + int(distance * 2 * Ultrasonic.us_per_cm)
+    while now_us() - start < pulse:
+        pass
+    return -1.0 if distance is None else distance
+
+
+async def heartbeat(stats):
+    last = now_us()
+    while True:
+        await asyncio.sleep(0.001)
+        t = now_us()
+        stats['beats'] += 1
+        stats['max_gap'] = max(stats['max_gap'], t - last)
+        last = t
+
+
+async def measure(name, read):
+    stats = {'beats': 0, 'max_gap': 0}
+    task = asyncio.create_task(heartbeat(stats))
+    await asyncio.sleep(0.01)
+    stats['beats'] = 0
+    stats['max_gap'] = 0
+    start = now_us()
+    for i in range(READINGS):
+        await read(DISTANCES[i % len(DISTANCES)])
+        await asyncio.sleep(0)
+    elapsed = now_us() - start
+    task.cancel()
+    print('{:<10} {:>9.0f} us/reading {:>6d} heartbeats {:>9.0f} us max '
+          'gap'.format(name, elapsed / READINGS, stats['beats'],
+                       stats['max_gap']))
+
+
+async def main():
+    async def blocking(distance):
+        return blocking_distance(distance)
+
+    sim = SimulatedSensor()
+    sensor = Ultrasonic(sim.trigger, sim.echo, timeout_us=TIMEOUT_US,
+                        ticks_us=sim.ticks_us)
+
+    async def irq(distance):
+        sim.distance = distance
+        return await sensor.distance()
+
+    await measure('blocking', blocking)
+    await measure('irq', irq)
+    print('irq driver: {} pings, {} timeouts'.format(sensor.pings,
+                                                     sensor.timeouts))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
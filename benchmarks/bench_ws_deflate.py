@@ -0,0 +1,92 @@
+"""WebSocket compression benchmark.
+
+Sends a stream of JSON sensor messages like the ones the examples send, and
+compares uncompressed frames with ``permessage-deflate`` frames using
+several window sizes, with and without context takeover. For each
+configuration, the average number of bytes on the wire per message, the
+ratio to the uncompressed size, and the time spent encoding each message
+are reported.
+
+Run from the root of the repository with
+``python benchmarks/bench_ws_deflate.py``.
+"""
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+
+from microdot.websocket import WebSocket, PerMessageDeflate  # noqa: E402
+
+MESSAGES = 2000
+CONFIGURATIONS = (
+    # (name, window bits, context takeover)
+    ('none', None, None),
+    ('w9 no-ctx', 9, False),
+    ('w12 no-ctx', 12, False),
+    ('w15 no-ctx', 15, False),
+    ('w9 ctx', 9, True),
+    ('w12 ctx', 12, True),
+    ('w15 ctx', 15, True),
+)
+
+
+def now():
+    if hasattr(time, 'ticks_us'):  # pragma: no cover
+        return time.ticks_us() / 1000000
+    return time.perf_counter()
+
+
+def messages():
+    random.seed(1)
+    distance = 50.0
+    result = []
+    for i in range(MESSAGES):
+        distance = max(2.0, min(400.0, distance + random.uniform(-2, 2)))
+        result.append(json.dumps({
+            'seq': i,
+            'distance': round(distance, 1),
+            'potentiometer': random.randint(1800, 1900),
+            'status': 'ok',
+        }))
+    return result
+
+
+def run(data, window_bits, context_takeover):
+    deflate = None
+    if window_bits is not None:
+        deflate = PerMessageDeflate(window_bits, window_bits,
+                                    context_takeover, context_takeover)
+    total = 0
+    start = now()
+    for message in data:
+        payload = message.encode()
+        compressed = False
+        if deflate and len(payload) >= WebSocket.deflate_min_size:
+            payload = deflate.compress(payload)
+            compressed = True
+        total += len(WebSocket._encode_websocket_frame(
+            WebSocket.TEXT, payload, compressed))
+    return total, now() - start
+
+
+def main():
+    data = messages()
+    print('average message: {} bytes'.format(
+        sum(len(m) for m in data) // len(data)))
+    print('{:<12} {:>12} {:>8} {:>12}'.format('config', 'wire B/msg',
+                                              'ratio', 'us/msg'))
+    baseline = None
+    for name, window_bits, context_takeover in CONFIGURATIONS:
+        total, elapsed = run(data, window_bits, context_takeover)
+        if baseline is None:
+            baseline = total
+        print('{:<12} {:>12.1f} {:>8.2f} {:>12.1f}'.format(
+            name, total / len(data), total / baseline,
+            elapsed / len(data) * 1000000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""WebSocket send queue benchmark.
+
+Sends telemetry messages every 10 ms for two seconds to a client on a slow
+link, simulated by a stream that takes a fixed time per byte written, and
+compares writing each message as it is sent with the send queue policies
+of the ``WebSocket`` class. For each approach, the number of messages
+delivered, the average and largest age of the messages when they are
+delivered, and the longest time the sending task was blocked are reported.
+
+Run from the root of the repository with
+``python benchmarks/bench_ws_send_queue.py``.
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+
+from microdot import Microdot, Request  # noqa: E402
+from microdot.websocket import WebSocket  # noqa: E402
+
+DURATION = 2.0  # seconds of sending
+SEND_INTERVAL = 0.01  # seconds between messages
+MESSAGE_SIZE = 200  # bytes per message
+BANDWIDTH = 5000  # bytes per second the link can carry
+POLICIES = (None, 'drop-oldest', 'drop-newest', 'coalesce-latest')
+
+
+def now():
+    if hasattr(time, 'ticks_us'):  # pragma: no cover
+        return time.ticks_us() / 1000000
+    return time.perf_counter()
+
+
+class SlowStream:
+    """A stream that delivers the frames at a limited bandwidth and records
+    the age of the messages they carry."""
+    def __init__(self, sent):
+        self.sent = sent
+        self.ages = []
+
+    async def awrite(self, frame):
+        await asyncio.sleep(len(frame) / BANDWIDTH)
+        seq = int(bytes(frame[-MESSAGE_SIZE:][:6]))
+        self.ages.append(now() - self.sent[seq])
+
+
+async def measure(policy):
+    sent = {}
+    stream = SlowStream(sent)
+    request = Request(Microdot(), None, 'GET', '/', '1.1', {})
+    request.sock = (None, stream)
+    ws = WebSocket(request)
+    if policy:
+        ws.enable_send_queue(4, policy)
+    blocked = 0
+    end = now() + DURATION
+    seq = 0
+    while now() < end:
+        start = now()
+        sent[seq] = start
+        await ws.send(b'%06d' % seq + b'x' * (MESSAGE_SIZE - 6),
+                      key='telemetry')
+        blocked = max(blocked, now() - start)
+        seq += 1
+        await asyncio.sleep(SEND_INTERVAL)
+    if ws.send_queue:
+        ws.send_queue.stop()
+    ages = stream.ages
+    print('{:<16} {:>5} {:>10} {:>12.0f} {:>12.0f} {:>12.0f}'.format(
+        policy or 'direct', seq, len(ages), sum(ages) / len(ages) * 1000,
+        max(ages) * 1000, blocked * 1000))
+
+
+async def main():
+    print('{:<16} {:>5} {:>10} {:>12} {:>12} {:>12}'.format(
+        'policy', 'sent', 'delivered', 'avg age ms', 'max age ms',
+        'blocked ms'))
+    for policy in POLICIES:
+        await measure(policy)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,77 @@
+"""WebSocket frame receive benchmark.
+
+Parses masked client frames of 100 B, 4 KB and 64 KB from memory with
+``WebSocket._read_frame``, and compares the original per-byte unmasking
+generator with the word-wise unmasking now used by the ``WebSocket`` class.
+The throughput in MB/s and the time per frame are reported for each size.
+
+Run from the root of the repository with
+``python benchmarks/bench_ws_unmask.py``.
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+
+from microdot import Request  # noqa: E402
+from microdot.microdot import AsyncBytesIO  # noqa: E402
+from microdot.websocket import WebSocket  # noqa: E402
+
+SIZES = (100, 4 * 1024, 64 * 1024)
+TOTAL_BYTES = 2 * 1024 * 1024  # bytes received per size and method
+
+
+def now():
+    if hasattr(time, 'ticks_us'):  # pragma: no cover
+        return time.ticks_us() / 1000000
+    return time.perf_counter()
+
+
+def masked_frame(payload, mask=b'\x12\x34\x56\x78'):
+    frame = bytearray(WebSocket._encode_websocket_frame(WebSocket.BINARY,
+                                                        payload))
+    header_length = len(frame) - len(payload)
+    frame[1] |= 0x80
+    frame[header_length:header_length] = mask
+    frame[header_length + 4:] = bytes(
+        x ^ mask[i % 4] for i, x in enumerate(payload))
+    return bytes(frame)
+
+
+class BytewiseWebSocket(WebSocket):
+    """The original unmasking implementation."""
+    def _unmask(self, payload, mask):
+        return bytes(x ^ mask[i % 4] for i, x in enumerate(payload))
+
+
+async def receive(ws_class, size):
+    payload = os.urandom(size)
+    count = max(TOTAL_BYTES // size, 1)
+    request = Request(None, None, 'GET', '/', '1.1', {})
+    request.sock = (AsyncBytesIO(masked_frame(payload) * count), None)
+    ws = ws_class(request)
+    start = now()
+    for _ in range(count):
+        _, opcode, data, _ = await ws._read_frame()
+    elapsed = now() - start
+    assert data == payload
+    return count, elapsed
+
+
+async def main():
+    WebSocket.max_message_length = max(SIZES)
+    print('{:>8} {:>10} {:>12} {:>12}'.format('size', 'method', 'MB/s',
+                                              'us/frame'))
+    for size in SIZES:
+        for name, ws_class in (('bytewise', BytewiseWebSocket),
+                               ('wordwise', WebSocket)):
+            count, elapsed = await receive(ws_class, size)
+            print('{:>8} {:>10} {:>12.2f} {:>12.1f}'.format(
+                size, name, size * count / elapsed / 1000000,
+                elapsed / count * 1000000))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,145 @@
+"""
+coalescer
+---------
+
+The ``coalescer`` module merges bursts of actuator commands, such as the
+messages a web page sends on every move of a slider, so that only the most
+recent value for each actuator is applied, at a bounded rate.
+"""
+import asyncio
+
+try:
+    from time import ticks_ms, ticks_diff
+except ImportError:  # pragma: no cover
+    from time import monotonic
+
+    def ticks_ms():
+        return int(monotonic() * 1000)
+
+    def ticks_diff(ticks1, ticks2):
+        return ticks1 - ticks2
+
+
+class Coalescer:
+    """Apply the latest command for each actuator at a bounded rate.
+
+    :param apply: The function that drives the actuators. It receives a
+                  dictionary with the latest value of each key that was
+                  updated since the previous call, in the order of their
+                  most recent updates. It can be a regular function or a
+                  coroutine.
+    :param interval: The minimum number of milliseconds between two calls to
+                     the ``apply`` function.
+
+    Commands are stored with :meth:`put` under a key that identifies the
+    actuator, for example ``'servo'`` or ``('led', 0)``. A command replaces
+    any pending command with the same key, so a WebSocket receiver can put
+    commands as fast as they arrive without waiting for the hardware, and
+    the hardware is updated at most once per interval. Example::
+
+        from coalescer import Coalescer
+
+        def apply(updates):
+            for key, value in updates.items():
+                if key == 'servo':
+                    set_servo(value)
+                else:
+                    np[key[1]] = value
+            np.write()
+
+        actuators = Coalescer(apply, interval=50)
+        actuators.start()
+
+        # in a WebSocket handler
+        data = json.loads(await ws.receive())
+        actuators.put('servo', data['servo'])
+
+    The same coalescer can be shared by all the connections that control
+    the same hardware.
+    """
+    def __init__(self, apply, interval=50):
+        self.apply = apply
+        self.interval = interval
+        #: The commands waiting to be applied, indexed by key.
+        self.pending = {}
+        #: The number of commands received.
+        self.received = 0
+        #: The number of commands that were replaced by a newer command
+        #: before they were applied.
+        self.coalesced = 0
+        #: The number of calls made to the ``apply`` function.
+        self.batches = 0
+        #: The ``ticks_ms()`` time at which the oldest pending command was
+        #: received.
+        self.since = None
+        #: The largest number of milliseconds a command waited to be applied.
+        self.max_latency = 0
+        self.last = None
+        self.event = asyncio.Event()
+        self.task = None
+
+    def put(self, key, value):
+        """Store a command, replacing the pending command with the same key.
+
+        :param key: The key that identifies the actuator.
+        :param value: The value to apply.
+        """
+        self.received += 1
+        if key in self.pending:
+            # move the key to the end, so that the commands are applied in
+            # the order of their latest update
+            del self.pending[key]
+            self.coalesced += 1
+        elif not self.pending:
+            self.since = ticks_ms()
+        self.pending[key] = value
+        self.event.set()
+
+    def start(self):
+        """Start the task that applies the commands, if it is not running
+        already."""
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+        return self.task
+
+    def stop(self):
+        """Stop the task that applies the commands."""
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def flush(self):
+        """Apply the pending commands immediately."""
+        if not self.pending:
+            return
+        updates = self.pending
+        self.pending = {}
+        self.last = ticks_ms()
+        latency = ticks_diff(self.last, self.since)
+        if latency > self.max_latency:
+            self.max_latency = latency
+        self.batches += 1
+        try:
+            result = self.apply(updates)
+            if hasattr(result, 'send'):
+                await result
+        except Exception as exc:
+            print('Error applying commands: {}'.format(exc))
+
+    async def run(self):
+        while True:
+            await self.event.wait()
+            self.event.clear()
+            if self.last is not None:
+                delay = self.interval - ticks_diff(ticks_ms(), self.last)
+                if delay > 0:
+                    # commands received while waiting replace the pending
+                    # ones
+                    await asyncio.sleep(delay / 1000)
+            await self.flush()
+
+    def stats(self):
+        """Return a dictionary with the command counters."""
+        return {'received': self.received, 'coalesced': self.coalesced,
+                'batches': self.batches, 'pending': len(self.pending),
+                'max_latency_ms': self.max_latency}
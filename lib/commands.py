@@ -0,0 +1,209 @@
+"""
+commands
+--------
+
+The ``commands`` module routes the JSON command messages that web pages send
+over a WebSocket to handler functions, with the arguments of each command
+validated and converted before the handler is called.
+"""
+import json
+
+
+class Int:
+    """Validator for integer arguments.
+
+    :param min: The smallest accepted value, or ``None`` for no limit.
+    :param max: The largest accepted value, or ``None`` for no limit.
+    """
+    def __init__(self, min=None, max=None):
+        self.min = min
+        self.max = max
+
+    def __call__(self, value):
+        if type(value) is not int:
+            if type(value) is not float or value != int(value):
+                raise ValueError('expected an integer')
+            value = int(value)
+        if (self.min is not None and value < self.min) or \
+                (self.max is not None and value > self.max):
+            raise ValueError('out of range')
+        return value
+
+
+class Float:
+    """Validator for numeric arguments, which are converted to float. NaN
+    and infinite values are rejected.
+
+    :param min: The smallest accepted value, or ``None`` for no limit.
+    :param max: The largest accepted value, or ``None`` for no limit.
+    """
+    def __init__(self, min=None, max=None):
+        self.min = min
+        self.max = max
+
+    def __call__(self, value):
+        if type(value) is not float:
+            if type(value) is not int:
+                raise ValueError('expected a number')
+            value = float(value)
+        if value - value != 0:
+            # NaN and infinities would pass the range checks
+            raise ValueError('expected a finite number')
+        if (self.min is not None and value < self.min) or \
+                (self.max is not None and value > self.max):
+            raise ValueError('out of range')
+        return value
+
+
+class Color:
+    """Validator for ``#rrggbb`` color arguments, which are converted to
+    ``(r, g, b)`` tuples."""
+    def __call__(self, value):
+        if type(value) is not str or len(value) != 7 or value[0] != '#':
+            raise ValueError('expected a #rrggbb color')
+        for c in value[1:]:
+            # int() would also accept signs, prefixes and underscores
+            if c not in '0123456789abcdefABCDEF':
+                raise ValueError('expected a #rrggbb color')
+        rgb = int(value[1:], 16)
+        return (rgb >> 16, (rgb >> 8) & 0xff, rgb & 0xff)
+
+
+class CommandRouter:
+    """Dispatch JSON command messages to handler functions.
+
+    :param type_field: The name of the field that holds the command name.
+                       If not given, the command is identified by the first
+                       field of the message that has a registered handler,
+                       in the iteration order of the decoded JSON object.
+                       That order is not guaranteed to match the message
+                       in MicroPython, so without a ``type_field`` each
+                       message should contain the field of only one
+                       command.
+    :param max_length: The maximum length of a message. Longer messages are
+                       rejected without being parsed.
+
+    Each command is registered with the validators of its arguments, given
+    as ``(field, validator)`` tuples. A validator is a function that
+    receives the value of the field and returns the converted value, or
+    raises ``ValueError`` to reject it. :class:`Int`, :class:`Float` and
+    :class:`Color` cover the common cases, and built-in functions such as
+    ``str`` can also be used. The handler is called with the converted
+    values as positional arguments, in the order of the validators.
+    Example::
+
+        from commands import CommandRouter, Color, Float, Int
+
+        commands = CommandRouter()
+
+        @commands.command('led', ('led', Int(0, 1)), ('color', Color()))
+        def set_led(index, color):
+            np[index] = color
+            np.write()
+
+        @commands.command('servo', ('servo', Float(0, 1)))
+        def set_servo(value):
+            servo.duty_ns(int(500000 + value * 2000000))
+
+        # in a WebSocket handler
+        while True:
+            message = await ws.receive()
+            if not await commands.dispatch(message):
+                print('Invalid command:', commands.last_error)
+
+    Messages that are too long, are not JSON objects, name an unknown
+    command or have invalid arguments are rejected before the handler is
+    called.
+    """
+    def __init__(self, type_field=None, max_length=256):
+        self.type_field = type_field
+        self.max_length = max_length
+        #: The registered commands, indexed by name, as
+        #: ``(handler, validators)`` tuples.
+        self.handlers = {}
+        #: The number of messages that were dispatched to a handler.
+        self.dispatched = 0
+        #: The number of messages that were rejected.
+        self.rejected = 0
+        #: The reason the last rejected message was rejected.
+        self.last_error = None
+
+    def command(self, name, *fields):
+        """Decorator that registers a command handler.
+
+        :param name: The name of the command.
+        :param fields: The arguments of the command, given as
+                       ``(field, validator)`` tuples.
+        """
+        def decorated(f):
+            self.add(name, f, *fields)
+            return f
+        return decorated
+
+    def add(self, name, handler, *fields):
+        """Register a command handler.
+
+        :param name: The name of the command.
+        :param handler: The function that handles the command. It can be a
+                        regular function or a coroutine.
+        :param fields: The arguments of the command, given as
+                       ``(field, validator)`` tuples.
+        """
+        self.handlers[name] = (handler, tuple(fields))
+
+    def reject(self, error):
+        self.rejected += 1
+        self.last_error = error
+        return False
+
+    async def dispatch(self, message, *args):
+        """Validate a message and call the handler of its command.
+
+        :param message: The message, as received from the WebSocket.
+        :param args: Additional arguments to pass to the handler, before
+                     the arguments of the command.
+
+        The return value is ``True`` if the message was handled, or
+        ``False`` if it was rejected, in which case the reason is stored in
+        ``last_error``.
+        """
+        # reject what cannot be a command before parsing it
+        if type(message) is not str or len(message) > self.max_length:
+            return self.reject('message too long or not text')
+        if not message.startswith('{'):
+            return self.reject('not a JSON object')
+        try:
+            data = json.loads(message)
+        except ValueError:
+            return self.reject('invalid JSON')
+        if type(data) is not dict:
+            return self.reject('not a JSON object')
+        if self.type_field is not None:
+            name = data.get(self.type_field)
+            entry = self.handlers.get(name) if type(name) is str else None
+        else:
+            entry = None
+            for key in data:
+                entry = self.handlers.get(key)
+                if entry is not None:
+                    break
+        if entry is None:
+            return self.reject('unknown command')
+        handler, fields = entry
+        values = list(args)
+        for field, validator in fields:
+            try:
+                values.append(validator(data[field]))
+            except KeyError:
+                return self.reject('missing field ' + field)
+            except (TypeError, ValueError, OverflowError) as exc:
+                return self.reject('invalid field {}: {}'.format(field, exc))
+        self.dispatched += 1
+        result = handler(*values)
+        if hasattr(result, 'send'):
+            await result
+        return True
+
+    def stats(self):
+        """Return a dictionary with the dispatch counters."""
+        return {'dispatched': self.dispatched, 'rejected': self.rejected}
@@ -0,0 +1,87 @@
+import os
+
+try:
+    from collections import OrderedDict
+except ImportError:  # pragma: no cover
+    from ucollections import OrderedDict
+
+
+class FileCache:
+    """An in-memory cache of static files with LRU eviction.
+
+    :param max_size: The maximum number of bytes of file data held in memory.
+    :param max_file_size: Files larger than this size are never cached. If
+                          omitted, a quarter of ``max_size`` is used.
+
+    Files are stored fully in memory as immutable bytes objects, and are
+    invalidated when their modification time or size change. When the cache
+    is full, the least recently used files are evicted. To enable the cache
+    for all the files sent with :func:`send_file <microdot.send_file>`, assign
+    an instance to ``Response.file_cache``::
+
+        from microdot import Response
+        from microdot.file_cache import FileCache
+
+        Response.file_cache = FileCache(max_size=32 * 1024)
+    """
+    def __init__(self, max_size=32 * 1024, max_file_size=None):
+        self.max_size = max_size
+        self.max_file_size = max_size // 4 if max_file_size is None \
+            else max_file_size
+        #: The number of bytes of file data currently held in memory.
+        self.size = 0
+        #: The number of lookups that were served from memory.
+        self.hits = 0
+        #: The number of lookups that had to read the file.
+        self.misses = 0
+        #: The number of files evicted to stay within ``max_size``.
+        self.evictions = 0
+        self.entries = OrderedDict()
+
+    def get(self, filename, st=None):
+        """Return the contents of a file, as bytes.
+
+        :param filename: The path of the file.
+        :param st: The result of ``os.stat()`` for the file, if the caller
+                   already has it.
+
+        If the file is too large to be cached, ``None`` is returned and the
+        caller is expected to stream it from storage. An ``OSError`` is raised
+        if the file does not exist.
+        """
+        st = st or os.stat(filename)
+        size = st[6]
+        mtime = st[8]
+        entry = self.entries.pop(filename, None)
+        if entry is not None:
+            if entry[1] == mtime and entry[2] == size:
+                self.hits += 1
+                self.entries[filename] = entry  # most recently used
+                return entry[0]
+            self.size -= len(entry[0])
+        self.misses += 1
+        if size > self.max_file_size:
+            return None
+        with open(filename, 'rb') as f:
+            data = f.read()
+        while self.entries and self.size + len(data) > self.max_size:
+            self.size -= len(self.entries.pop(next(iter(self.entries)))[0])
+            self.evictions += 1
+        self.entries[filename] = (data, mtime, size)
+        self.size += len(data)
+        return data
+
+    def clear(self):
+        """Remove all the files from the cache."""
+        self.entries = OrderedDict()
+        self.size = 0
+
+    def stats(self):
+        """Return a dictionary with the cache counters."""
+        return {
+            'files': len(self.entries),
+            'size': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
@@ -0,0 +1,140 @@
+import asyncio
+from array import array
+
+from microdot.microdot import ticks_us, ticks_diff
+
+
+class LoopMonitor:
+    """Measure the scheduling delay of the asyncio loop.
+
+    :param app: The application to monitor.
+    :param interval: The number of seconds the monitor task sleeps between
+                     measurements.
+    :param threshold: The lag in seconds above which the loop is considered
+                      stalled and the stall is logged.
+    :param url: The URL of an endpoint that returns the statistics as JSON.
+                If omitted, no endpoint is registered.
+
+    The monitor task sleeps for ``interval`` seconds in a loop and measures
+    how late it wakes up. A late wake up means that some other code held the
+    loop, for example a handler that calls a blocking sensor function. The
+    lag of each measurement is recorded in a histogram.
+
+    The routes that handle requests, and the WebSocket routes that send or
+    receive messages, are recorded as they run. When a stall is detected, the
+    names recorded since the previous measurement are logged as the likely
+    culprits. Background tasks can record themselves with :meth:`mark`.
+    Example::
+
+        from microdot import Microdot
+        from microdot.loop_monitor import LoopMonitor
+
+        app = Microdot()
+        LoopMonitor(app, threshold=0.02, url='/loop')
+
+    The monitor task is started by the server, and stopped when it exits.
+    """
+    #: The upper bounds of the lag histogram buckets, in microseconds.
+    #: Longer lags are counted in an additional overflow bucket.
+    buckets = (1000, 2000, 5000, 10000, 20000, 50000, 100000, 200000,
+               500000)
+
+    #: The maximum number of names that are remembered between two
+    #: measurements.
+    max_names = 8
+
+    #: The number of recent stalls that are kept in ``stalls``.
+    max_stalls = 8
+
+    def __init__(self, app=None, interval=0.02, threshold=0.05, url=None):
+        self.interval = interval
+        self.threshold = threshold
+        self.names = []
+        self.task = None
+        self.reset()
+        if app is not None:
+            self.initialize(app, url=url)
+
+    def initialize(self, app, url=None):
+        """Initialize the monitor for the given application.
+
+        :param app: The application to monitor.
+        :param url: The URL of an endpoint that returns the statistics as
+                    JSON. If omitted, no endpoint is registered.
+        """
+        app.loop_monitor = self
+        if url:
+            app.route(url)(self.stats_handler)
+
+    def reset(self):
+        """Discard all the recorded statistics."""
+        #: The histogram of the measured lags.
+        self.counts = array('L', [0] * (len(self.buckets) + 1))
+        #: The largest lag measured, in microseconds.
+        self.max_lag = 0
+        #: The number of measurements above the threshold.
+        self.stall_count = 0
+        #: The most recent stalls, as ``(lag, names)`` tuples with the lag in
+        #: microseconds.
+        self.stalls = []
+
+    def mark(self, name):
+        """Record that the code identified by ``name`` is running.
+
+        :param name: The name of a route or task.
+        """
+        if name not in self.names and len(self.names) < self.max_names:
+            self.names.append(name)
+
+    def start(self):
+        """Start the monitor task, if it is not running already."""
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    def stop(self):
+        """Stop the monitor task."""
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def run(self):
+        interval = int(self.interval * 1000000)
+        threshold = int(self.threshold * 1000000)
+        n = len(self.buckets)
+        while True:
+            start = ticks_us()
+            await asyncio.sleep(self.interval)
+            lag = max(ticks_diff(ticks_us(), start) - interval, 0)
+            i = 0
+            while i < n and lag > self.buckets[i]:
+                i += 1
+            self.counts[i] += 1
+            if lag > self.max_lag:
+                self.max_lag = lag
+            if lag > threshold:
+                self.stall_count += 1
+                names = self.names or ['<unknown>']
+                self.names = []
+                self.stalls.append((lag, names))
+                if len(self.stalls) > self.max_stalls:
+                    self.stalls.pop(0)
+                print('Event loop stalled for {lag} ms while running: '
+                      '{names}'.format(lag=lag // 1000,
+                                       names=', '.join(names)))
+            else:
+                self.names.clear()
+
+    def stats(self):
+        """Return a dictionary with the monitor statistics."""
+        return {
+            'interval_us': int(self.interval * 1000000),
+            'buckets_us': list(self.buckets),
+            'counts': list(self.counts),
+            'max_lag_us': self.max_lag,
+            'stall_count': self.stall_count,
+            'stalls': [{'lag_us': lag, 'names': names}
+                       for lag, names in self.stalls],
+        }
+
+    async def stats_handler(self, request):
+        return self.stats()
@@ -0,0 +1,214 @@
+from array import array
+
+try:
+    array('Q', [0])
+    _typecode = 'Q'
+except ValueError:  # pragma: no cover
+    _typecode = 'L'
+
+# layout of the counters of a route
+REQUESTS = 0
+STATUS = 1  # five counters, for the 1xx to 5xx status classes
+BYTES_IN = 6
+BYTES_OUT = 7
+PHASES_START = 8
+PHASES = ('parse', 'handler', 'write')
+
+
+class Metrics:
+    """Record per-route request statistics.
+
+    :param app: The application to instrument.
+    :param url: The URL of the endpoint that returns the statistics. Set to
+                ``None`` to not register an endpoint.
+    :param max_routes: The maximum number of routes that are tracked
+                       individually. Requests for additional routes are
+                       recorded under the ``other_route`` name.
+
+    For each route the number of requests, the number of responses in each
+    status class and the bytes received in request bodies and sent in
+    responses are counted. The time spent parsing the request, running the
+    handler and writing the response are recorded in latency histograms with
+    fixed buckets. All the counters of a route are stored in a single integer
+    array that is allocated when the route receives its first request.
+
+    The endpoint returns the statistics in the Prometheus text format, or as
+    JSON when the ``format=json`` query string argument is given. Example::
+
+        from microdot import Microdot
+        from microdot.metrics import Metrics
+
+        app = Microdot()
+        Metrics(app, url='/metrics')
+
+    When an application does not have a ``Metrics`` instance, the server does
+    not take any timings.
+    """
+    #: The upper bounds of the latency histogram buckets, in microseconds.
+    #: Longer durations are counted in an additional overflow bucket.
+    buckets = (500, 1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000,
+               1000000)
+
+    #: The name under which requests that did not match a route, or that
+    #: exceed ``max_routes``, are recorded.
+    other_route = '<other>'
+
+    def __init__(self, app=None, url='/metrics', max_routes=16):
+        self.max_routes = max_routes
+        #: The counters of each route, indexed by URL pattern.
+        self.routes = {}
+        self.phase_size = len(self.buckets) + 2  # buckets, overflow and sum
+        if app is not None:
+            self.initialize(app, url=url)
+
+    def initialize(self, app, url='/metrics'):
+        """Initialize the metrics for the given application.
+
+        :param app: The application to instrument.
+        :param url: The URL of the endpoint that returns the statistics. Set
+                    to ``None`` to not register an endpoint. The endpoint
+                    takes precedence over the routes that were registered
+                    before it.
+        """
+        app.metrics = self
+        if url:
+            app.route(url)(self.metrics_handler)
+            # move the endpoint ahead of the routes registered before it, so
+            # that a catch-all route such as ``/<path:path>`` does not
+            # shadow it
+            app.url_map.insert(0, app.url_map.pop())
+            app.routes_changed()
+
+    def get_counters(self, route):
+        """Return the counters array of a route, allocating it if needed.
+
+        :param route: The URL pattern of the route.
+        """
+        counters = self.routes.get(route)
+        if counters is None:
+            if route != self.other_route and \
+                    len(self.routes) >= self.max_routes:
+                return self.get_counters(self.other_route)
+            counters = array(_typecode, [0] * (
+                PHASES_START + len(PHASES) * self.phase_size))
+            self.routes[route] = counters
+        return counters
+
+    def record(self, req, res, handler_time, write_time):
+        """Record a request.
+
+        :param req: The request object, or ``None`` if the request could not
+                    be parsed.
+        :param res: The response object.
+        :param handler_time: The time in microseconds spent dispatching the
+                             request.
+        :param write_time: The time in microseconds spent writing the
+                           response.
+
+        The durations of responses that took over the connection, such as
+        WebSocket sessions, are not added to the histograms.
+        """
+        counters = self.get_counters(
+            (req.url_pattern if req else None) or self.other_route)
+        counters[REQUESTS] += 1
+        status_class = res.status_code // 100
+        if 1 <= status_class <= 5:
+            counters[STATUS + status_class - 1] += 1
+        if req:
+            counters[BYTES_IN] += req.content_length
+        counters[BYTES_OUT] += res.bytes_written
+        if res is res.already_handled:
+            return
+        if req:
+            self.observe(counters, 0, req.parse_time)
+        self.observe(counters, 1, handler_time)
+        self.observe(counters, 2, write_time)
+
+    def observe(self, counters, phase, duration):
+        """Add a duration to the histogram of a phase.
+
+        :param counters: The counters array of the route.
+        :param phase: The index of the phase in ``PHASES``.
+        :param duration: The duration in microseconds.
+        """
+        start = PHASES_START + phase * self.phase_size
+        i = 0
+        n = len(self.buckets)
+        while i < n and duration > self.buckets[i]:
+            i += 1
+        counters[start + i] += 1
+        counters[start + n + 1] += duration
+
+    def reset(self):
+        """Discard all the recorded statistics."""
+        self.routes = {}
+
+    def to_dict(self):
+        """Return the statistics as a dictionary.
+
+        Histogram bucket counts are not cumulative. The last count of each
+        histogram is for the durations that exceed the largest bucket.
+        """
+        n = len(self.buckets)
+        routes = {}
+        for route, counters in self.routes.items():
+            stats = {
+                'requests': counters[REQUESTS],
+                'status': {'{}xx'.format(i + 1): counters[STATUS + i]
+                           for i in range(5)},
+                'bytes_in': counters[BYTES_IN],
+                'bytes_out': counters[BYTES_OUT],
+            }
+            for phase, name in enumerate(PHASES):
+                start = PHASES_START + phase * self.phase_size
+                stats[name] = {
+                    'counts': list(counters[start:start + n + 1]),
+                    'sum_us': counters[start + n + 1],
+                }
+            routes[route] = stats
+        return {'buckets_us': list(self.buckets), 'routes': routes}
+
+    def to_prometheus(self):
+        """Return the statistics in the Prometheus text exposition
+        format."""
+        n = len(self.buckets)
+        labels = [str(b / 1000000) for b in self.buckets] + ['+Inf']
+        routes = [('route="{}"'.format(
+            route.replace('\\', '\\\\').replace('"', '\\"')), counters)
+            for route, counters in self.routes.items()]
+        lines = ['# TYPE microdot_requests_total counter']
+        for route, counters in routes:
+            lines.append('microdot_requests_total{%s} %d' % (
+                route, counters[REQUESTS]))
+        lines.append('# TYPE microdot_responses_total counter')
+        for route, counters in routes:
+            for i in range(5):
+                lines.append(
+                    'microdot_responses_total{%s,status="%dxx"} %d' % (
+                        route, i + 1, counters[STATUS + i]))
+        for name, index in (('request', BYTES_IN), ('response', BYTES_OUT)):
+            lines.append('# TYPE microdot_{}_bytes_total counter'.format(name))
+            for route, counters in routes:
+                lines.append('microdot_%s_bytes_total{%s} %d' % (
+                    name, route, counters[index]))
+        for phase, name in enumerate(PHASES):
+            metric = 'microdot_{}_seconds'.format(name)
+            lines.append('# TYPE {} histogram'.format(metric))
+            start = PHASES_START + phase * self.phase_size
+            for route, counters in routes:
+                total = 0
+                for i in range(n + 1):
+                    total += counters[start + i]
+                    lines.append('%s_bucket{%s,le="%s"} %d' % (
+                        metric, route, labels[i], total))
+                lines.append('%s_sum{%s} %s' % (
+                    metric, route, counters[start + n + 1] / 1000000))
+                lines.append('%s_count{%s} %d' % (metric, route, total))
+        lines.append('')
+        return '\n'.join(lines)
+
+    async def metrics_handler(self, request):
+        if request.args.get('format') == 'json':
+            return self.to_dict()
+        return self.to_prometheus(), 200, {
+            'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
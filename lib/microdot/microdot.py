@@ -7,6 +7,7 @@ servers for MicroPython and standard Python.
 """
 import asyncio
 import io
+import os
 import re
 import time
 
@@ -45,6 +46,15 @@ except ImportError:  # pragma: no cover
             ret = await ret
         return ret
 
+try:
+    from time import ticks_us, ticks_diff
+except ImportError:  # pragma: no cover
+    def ticks_us():
+        return time.perf_counter_ns() // 1000
+
+    def ticks_diff(ticks1, ticks2):
+        return ticks1 - ticks2
+
 try:
     from sys import print_exception
 except ImportError:  # pragma: no cover
@@ -85,6 +95,41 @@ def urlencode(s):
             '&', '%26').replace('=', '%3D')
 
 
+WEEKDAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct',
+          'Nov', 'Dec']
+
+
+def http_date(timestamp):
+    """Format a timestamp as an HTTP date, such as
+    ``Sun, 06 Nov 1994 08:49:37 GMT``."""
+    t = time.gmtime(timestamp)
+    return '{}, {:02d} {} {:04d} {:02d}:{:02d}:{:02d} GMT'.format(
+        WEEKDAYS[t[6]], t[2], MONTHS[t[1] - 1], t[0], t[3], t[4], t[5])
+
+
+def parse_http_date(date):
+    """Parse an HTTP date into a ``(year, month, day, hour, minute, second)``
+    tuple that can be compared with other parsed dates. ``None`` is returned
+    if the date cannot be parsed."""
+    try:
+        _, day, month, year, clock, _ = date.split()
+        hour, minute, second = clock.split(':')
+        return (int(year), MONTHS.index(month) + 1, int(day), int(hour),
+                int(minute), int(second))
+    except ValueError:
+        return None
+
+
+async def wait_for(awaitable, timeout):
+    """Await an awaitable with an optional timeout in seconds. If the
+    timeout is ``None``, there is no time limit. ``asyncio.TimeoutError`` is
+    raised when the timeout expires."""
+    if timeout is None:
+        return await awaitable
+    return await asyncio.wait_for(awaitable, timeout)
+
+
 class NoCaseDict(dict):
     """A subclass of dictionary that holds case-insensitive keys.
 
@@ -276,7 +321,11 @@ class AsyncBytesIO:
         return self.stream.read(n)
 
     async def readuntil(self, separator=b'\n'):  # pragma: no cover
-        return self.stream.readuntil(separator=separator)
+        data = self.stream.getvalue()
+        start = self.stream.tell()
+        end = data.find(separator, start)
+        end = len(data) if end == -1 else end + len(separator)
+        return self.stream.read(end - start)
 
     async def awrite(self, data):  # pragma: no cover
         return self.stream.write(data)
@@ -285,6 +334,168 @@ class AsyncBytesIO:
         pass
 
 
+class BufferedStream:
+    """An input stream wrapper used by the buffered request parser.
+
+    :param stream: The input stream to wrap.
+    :param size: The initial size of the buffer, in bytes.
+
+    The request line and headers are read with bulk reads into a buffer that
+    is reused for all the requests of a connection. Data that is read past
+    the end of the headers is returned by the next reads, before the wrapped
+    stream is read again.
+    """
+    def __init__(self, stream, size=512):
+        self.stream = stream
+        self.buffer = bytearray(size)
+        self.start = 0
+        self.end = 0
+
+    def _take(self, n=-1):
+        end = self.end if n < 0 else min(self.start + n, self.end)
+        data = bytes(memoryview(self.buffer)[self.start:end])
+        self.start = end
+        return data
+
+    async def read_head(self):
+        """Read the request line and headers, up to and including the empty
+        line that ends them, and return them as bytes. The length of each
+        line is checked against ``Request.max_readline`` and the total size
+        against ``Request.max_header_size`` as they are read, so the buffer
+        never grows past ``max_header_size`` bytes."""
+        data = self._take() if self.start < self.end else None
+        self.start = self.end = 0
+        line = 0
+        while True:
+            if data is None:
+                if self.end >= Request.max_header_size:
+                    raise ValueError('headers too large')
+                if self.end == len(self.buffer):
+                    self.buffer.extend(bytes(min(
+                        len(self.buffer),
+                        Request.max_header_size - self.end)))
+                data = await self.stream.read(len(self.buffer) - self.end)
+                if not data:
+                    # end of stream before the end of the headers
+                    return self._take()
+            offset = self.end
+            self.end += len(data)
+            self.buffer[offset:self.end] = data
+            pos = 0
+            while True:
+                nl = data.find(b'\n', pos)
+                if nl == -1:
+                    line += len(data) - pos
+                    break
+                line += nl + 1 - pos
+                pos = nl + 1
+                if line > Request.max_readline:
+                    raise ValueError('line too long')
+                if line == 1 or (line == 2 and
+                                 self.buffer[offset + nl - 1] == 13):
+                    # empty line, the headers end here
+                    end = self.end
+                    self.end = offset + pos
+                    head = self._take()
+                    self.end = end
+                    return head
+                line = 0
+            if line > Request.max_readline:
+                raise ValueError('line too long')
+            data = None
+
+    async def fill(self):
+        """Wait until there is data to read, and store it in the buffer.
+        The return value is ``False`` if the end of the stream was reached
+        instead."""
+        if self.start < self.end:
+            return True
+        data = await self.stream.read(len(self.buffer))
+        self.start = 0
+        self.end = len(data)
+        self.buffer[:self.end] = data
+        return self.end > 0
+
+    async def read(self, n=-1):
+        if self.start < self.end:
+            return self._take(n)
+        return await self.stream.read(n)
+
+    async def readexactly(self, n):
+        if self.start < self.end:
+            data = self._take(n)
+            if len(data) < n:
+                data += await self.stream.readexactly(n - len(data))
+            return data
+        return await self.stream.readexactly(n)
+
+    async def readinto(self, buf):
+        if self.start < self.end:
+            n = min(len(buf), self.end - self.start)
+            buf[:n] = memoryview(self.buffer)[self.start:self.start + n]
+            self.start += n
+            return n
+        if hasattr(self.stream, 'readinto'):
+            return await self.stream.readinto(buf)
+        data = await self.stream.read(len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+    async def readline(self):
+        if self.start < self.end:
+            data = bytes(memoryview(self.buffer)[self.start:self.end])
+            nl = data.find(b'\n')
+            if nl != -1:
+                self.start += nl + 1
+                return data[:nl + 1]
+            self.start = self.end
+            return data + await self.stream.readline()
+        return await self.stream.readline()
+
+
+class LazyFile:
+    """A read-only binary file that is only opened when it is first used.
+
+    :param filename: The path of the file.
+    :param offset: The position in the file where reading starts.
+    :param length: The maximum number of bytes to read, or -1 to read until
+                   the end of the file.
+    """
+    def __init__(self, filename, offset=0, length=-1):
+        self.filename = filename
+        self.offset = offset
+        self.remaining = length
+        self.file = None
+
+    def _open(self):
+        if self.file is None:
+            self.file = open(self.filename, 'rb')
+            if self.offset:
+                self.file.seek(self.offset)
+        return self.file
+
+    def read(self, n=-1):
+        if self.remaining >= 0 and (n < 0 or n > self.remaining):
+            n = self.remaining
+        data = self._open().read(n)
+        if self.remaining >= 0:
+            self.remaining -= len(data)
+        return data
+
+    def readinto(self, buf):
+        if self.remaining >= 0 and len(buf) > self.remaining:
+            buf = memoryview(buf)[:self.remaining]
+        n = self._open().readinto(buf) or 0
+        if self.remaining >= 0:
+            self.remaining -= n
+        return n
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
 class Request:
     """An HTTP request."""
     #: Specify the maximum payload size that is accepted. Requests with larger
@@ -316,12 +527,54 @@ class Request:
     #:    Request.max_readline = 16 * 1024  # 16KB lines allowed
     max_readline = 2 * 1024
 
+    #: Specify the maximum size of the request line and headers combined.
+    #: Requests with larger headers are rejected with a 400 status code.
+    #:
+    #: Example::
+    #:
+    #:    Request.max_header_size = 8 * 1024  # 8KB headers allowed
+    max_header_size = 4 * 1024
+
+    #: Read the request line and headers with bulk reads into a buffer that
+    #: is reused for all the requests of a connection, instead of one read
+    #: per line. The header block is then split in one pass and the
+    #: ``headers`` dictionary is only decoded when it is first accessed.
+    #: This is faster for handlers that do not access ``headers``, but when
+    #: the dictionary is decoded, parsing is about as fast as, or slightly
+    #: slower than, the line by line parser.
+    #:
+    #: Example::
+    #:
+    #:    Request.buffered_parser = True
+    buffered_parser = False
+
+    #: The maximum number of seconds allowed for a client to send the request
+    #: line and headers. Connections that take longer are closed. Set to
+    #: ``None`` for no limit.
+    #:
+    #: On a persistent connection, the wait for the next request is bounded
+    #: by the ``keep_alive_timeout`` of the application instead, and this
+    #: timeout starts when the request line of that request arrives. Each
+    #: timeout bounds only its own phase of the request, so none of them
+    #: shortens another.
+    #:
+    #: Example::
+    #:
+    #:    Request.header_timeout = 30
+    header_timeout = 10
+
+    #: The maximum number of seconds allowed for a client to send a request
+    #: body of up to ``max_body_length`` bytes, counted from the end of the
+    #: headers. Connections that take longer are closed. Set to ``None`` for
+    #: no limit.
+    body_timeout = 10
+
     class G:
         pass
 
     def __init__(self, app, client_addr, method, url, http_version, headers,
                  body=None, stream=None, sock=None, url_prefix='',
-                 subapp=None):
+                 subapp=None, raw_headers=None):
         #: The application instance to which this request belongs.
         self.app = app
         #: The address of the client, as a tuple (host, port).
@@ -343,8 +596,9 @@ class Request:
         #: The parsed query string, as a
         #: :class:`MultiDict <microdot.MultiDict>` object.
         self.args = {}
-        #: A dictionary with the headers included in the request.
-        self.headers = headers
+        self._headers = headers
+        self._raw_headers = raw_headers
+        self._raw_headers_lower = None
         #: A dictionary with the cookies included in the request.
         self.cookies = {}
         #: The parsed ``Content-Length`` header.
@@ -360,12 +614,13 @@ class Request:
             self.path, self.query_string = self.path.split('?', 1)
             self.args = self._parse_urlencoded(self.query_string)
 
-        if 'Content-Length' in self.headers:
-            self.content_length = int(self.headers['Content-Length'])
-        if 'Content-Type' in self.headers:
-            self.content_type = self.headers['Content-Type']
-        if 'Cookie' in self.headers:
-            for cookie in self.headers['Cookie'].split(';'):
+        content_length = self._get_header('Content-Length')
+        if content_length is not None:
+            self.content_length = int(content_length)
+        self.content_type = self._get_header('Content-Type')
+        cookie_header = self._get_header('Cookie')
+        if cookie_header is not None:
+            for cookie in cookie_header.split(';'):
                 name, value = cookie.strip().split('=', 1)
                 self.cookies[name] = value
 
@@ -377,9 +632,16 @@ class Request:
         self._form = None
         self._files = None
         self.after_request_handlers = []
+        #: The URL pattern of the route that handles the request, or ``None``
+        #: if no route matched.
+        self.url_pattern = None
+        #: The time in microseconds spent reading and parsing the request
+        #: after its request line was received.
+        self.parse_time = 0
 
     @staticmethod
-    async def create(app, client_reader, client_writer, client_addr):
+    async def create(app, client_reader, client_writer, client_addr,
+                     keep_alive=False):
         """Create a request object.
 
         :param app: The Microdot application instance.
@@ -388,23 +650,75 @@ class Request:
         :param client_writer: An output stream where the response data can be
                               written.
         :param client_addr: The address of the client, as a tuple.
+        :param keep_alive: ``True`` if the request is read from a persistent
+                           connection that already served a request. The
+                           wait for the request to start is then bounded by
+                           the ``keep_alive_timeout`` of the application.
 
         This method is a coroutine. It returns a newly created ``Request``
-        object.
+        object, or ``None`` if the client closed the connection before
+        sending a request.
         """
+        if Request.buffered_parser:
+            return await Request._create_buffered(
+                app, client_reader, client_writer, client_addr, keep_alive)
+
+        line = None
+        if keep_alive:
+            # only the idle time before the next request is bounded by the
+            # keep-alive timeout, the rest of the request has its own limits
+            line = await wait_for(Request._safe_readline(client_reader),
+                                  app.keep_alive_timeout)
+            if not line:
+                return None
+
+        # the parsing time is only measured when metrics are recorded
+        timed = app.metrics is not None
+        head = await wait_for(Request._read_head(client_reader, timed, line),
+                              Request.header_timeout)
+        if head is None:  # pragma: no cover
+            return None
+        method, url, http_version, headers, content_length, start = head
+
+        # body
+        body = b''
+        if content_length and content_length <= Request.max_body_length:
+            body = await wait_for(client_reader.readexactly(content_length),
+                                  Request.body_timeout)
+            stream = None
+        else:
+            body = b''
+            stream = client_reader
+
+        req = Request(app, client_addr, method, url, http_version, headers,
+                      body=body, stream=stream,
+                      sock=(client_reader, client_writer))
+        if timed:
+            req.parse_time = ticks_diff(ticks_us(), start)
+        return req
+
+    @staticmethod
+    async def _read_head(client_reader, timed=False, line=None):
         # request line
-        line = (await Request._safe_readline(client_reader)).strip().decode()
+        if line is None:
+            line = await Request._safe_readline(client_reader)
+        line = line.strip().decode()
         if not line:  # pragma: no cover
             return None
+        start = ticks_us() if timed else 0
         method, url, http_version = line.split()
         http_version = http_version.split('/', 1)[1]
 
         # headers
         headers = NoCaseDict()
         content_length = 0
+        size = len(line)
         while True:
-            line = (await Request._safe_readline(
-                client_reader)).strip().decode()
+            line = await Request._safe_readline(client_reader)
+            size += len(line)
+            if size > Request.max_header_size:
+                raise ValueError('headers too large')
+            line = line.strip().decode()
             if line == '':
                 break
             header, value = line.split(':', 1)
@@ -412,19 +726,73 @@ class Request:
             headers[header] = value
             if header.lower() == 'content-length':
                 content_length = int(value)
+        return method, url, http_version, headers, content_length, start
+
+    @staticmethod
+    async def _create_buffered(app, client_reader, client_writer,
+                               client_addr, keep_alive=False):
+        if not isinstance(client_reader, BufferedStream):
+            client_reader = BufferedStream(client_reader)
+        if keep_alive and not await wait_for(client_reader.fill(),
+                                             app.keep_alive_timeout):
+            return None
+        block = await wait_for(client_reader.read_head(),
+                               Request.header_timeout)
+        timed = app.metrics is not None
+        if timed:
+            start = ticks_us()
+
+        # scan the block once, validating the header lines and finding the
+        # end of the request line
+        request_line_end = -1
+        pos = 0
+        while pos < len(block):
+            end = block.find(b'\n', pos)
+            if end == -1:
+                end = len(block)
+            if request_line_end == -1:
+                request_line_end = end
+            elif end - pos > 1 and block.find(b':', pos, end) == -1:
+                raise ValueError('invalid header')
+            pos = end + 1
+
+        # request line
+        line = block[:request_line_end].strip().decode()
+        if not line:  # pragma: no cover
+            return None
+        method, url, http_version = line.split()
+        http_version = http_version.split('/', 1)[1]
+
+        req = Request(app, client_addr, method, url, http_version, None,
+                      sock=(client_reader, client_writer), raw_headers=block)
 
         # body
-        body = b''
-        if content_length and content_length <= Request.max_body_length:
-            body = await client_reader.readexactly(content_length)
-            stream = None
+        if req.content_length and \
+                req.content_length <= Request.max_body_length:
+            req._body = await wait_for(
+                client_reader.readexactly(req.content_length),
+                Request.body_timeout)
         else:
-            body = b''
-            stream = client_reader
-
-        return Request(app, client_addr, method, url, http_version, headers,
-                       body=body, stream=stream,
-                       sock=(client_reader, client_writer))
+            req._body = b''
+            req._stream = client_reader
+        if timed:
+            req.parse_time = ticks_diff(ticks_us(), start)
+        return req
+
+    def _get_header(self, header):
+        if self._headers is not None:
+            return self._headers.get(header)
+        if self._raw_headers_lower is None:
+            self._raw_headers_lower = self._raw_headers.lower()
+        name = b'\n' + header.lower().encode() + b':'
+        start = self._raw_headers_lower.rfind(name)
+        if start == -1:
+            return None
+        start += len(name)
+        end = self._raw_headers.find(b'\n', start)
+        if end == -1:  # pragma: no cover
+            end = len(self._raw_headers)
+        return self._raw_headers[start:end].strip().decode()
 
     def _parse_urlencoded(self, urlencoded):
         data = MultiDict()
@@ -441,6 +809,23 @@ class Request:
                         if len(kv) > 1 else b''
         return data
 
+    @property
+    def headers(self):
+        """A dictionary with the headers included in the request."""
+        if self._headers is None:
+            headers = NoCaseDict()
+            for line in self._raw_headers.split(b'\n')[1:]:
+                line = line.strip()
+                if line:
+                    header, value = line.decode().split(':', 1)
+                    headers[header] = value.strip()
+            self._headers = headers
+        return self._headers
+
+    @headers.setter
+    def headers(self, value):
+        self._headers = value
+
     @property
     def body(self):
         """The body of the request, as bytes."""
@@ -556,8 +941,20 @@ class Response:
         'txt': 'text/plain',
     }
 
+    #: The size of the buffer used to send file bodies when a buffer of
+    #: ``send_file_max_buffer_size`` bytes cannot be allocated.
     send_file_buffer_size = 1024
 
+    #: The size of the buffer used to send file bodies. The buffer is
+    #: allocated once per connection, when the first file is sent, and is
+    #: reused for all the files sent on the connection.
+    send_file_max_buffer_size = 4096
+
+    #: Bodies given as bytes that are up to this size are sent in the same
+    #: write as the status line and headers. Set to 0 to always write the
+    #: body separately.
+    inline_body_size = 1024
+
     #: The content type to use for responses that do not explicitly define a
     #: ``Content-Type`` header.
     default_content_type = 'text/plain'
@@ -566,6 +963,11 @@ class Response:
     #: of ``None`` means that no ``Cache-Control`` header is added.
     default_send_file_max_age = None
 
+    #: A :class:`FileCache <microdot.file_cache.FileCache>` instance used by
+    #: :meth:`send_file` to serve files from memory. A value of ``None``
+    #: (the default) disables caching.
+    file_cache = None
+
     #: Special response used to signal that a response does not need to be
     #: written to the client. Used to exit WebSocket connections cleanly.
     already_handled = None
@@ -586,6 +988,13 @@ class Response:
             # this applies to bytes, file-like objects or generators
             self.body = body
         self.is_head = False
+        #: The HTTP version used in the status line of the response.
+        self.http_version = '1.0'
+        #: The number of writes issued to the stream by :meth:`write`.
+        self.write_count = 0
+        #: The number of bytes written to the stream by :meth:`write`,
+        #: including the status line and headers.
+        self.bytes_written = 0
 
     def set_cookie(self, cookie, value, path=None, domain=None, expires=None,
                    max_age=None, secure=False, http_only=False,
@@ -653,25 +1062,43 @@ class Response:
             # status code
             reason = self.reason if self.reason is not None else \
                 ('OK' if self.status_code == 200 else 'N/A')
-            await stream.awrite('HTTP/1.0 {status_code} {reason}\r\n'.format(
-                status_code=self.status_code, reason=reason).encode())
+            lines = ['HTTP/{version} {status_code} {reason}\r\n'.format(
+                version=self.http_version, status_code=self.status_code,
+                reason=reason)]
 
             # headers
             for header, value in self.headers.items():
                 values = value if isinstance(value, list) else [value]
                 for value in values:
-                    await stream.awrite('{header}: {value}\r\n'.format(
-                        header=header, value=value).encode())
-            await stream.awrite(b'\r\n')
+                    lines.append('{header}: {value}\r\n'.format(
+                        header=header, value=value))
+            lines.append('\r\n')
+            head = ''.join(lines).encode()
+
+            # status line, headers and small bodies are sent in one write
+            inline = not self.is_head and isinstance(self.body, bytes) and \
+                len(self.body) <= self.inline_body_size
+            data = head + self.body if inline else head
+            await stream.awrite(data)
+            self.write_count += 1
+            self.bytes_written += len(data)
 
             # body
-            if not self.is_head:
+            if not self.is_head and not inline and \
+                    hasattr(self.body, 'readinto'):
+                try:
+                    await self._write_file(stream)
+                finally:
+                    self.body.close()
+            elif not self.is_head and not inline:
                 iter = self.body_iter()
                 async for body in iter:
                     if isinstance(body, str):  # pragma: no cover
                         body = body.encode()
                     try:
                         await stream.awrite(body)
+                        self.write_count += 1
+                        self.bytes_written += len(body)
                     except OSError as exc:  # pragma: no cover
                         if exc.errno in MUTED_SOCKET_ERRORS or \
                                 exc.args[0] == 'Connection lost':
@@ -688,6 +1115,151 @@ class Response:
             else:
                 raise
 
+    async def _write_file(self, stream):
+        transport = getattr(stream, 'transport', None)
+        if transport is not None and hasattr(asyncio, 'get_running_loop'):
+            # CPython streams hand the file over to the event loop, which
+            # uses os.sendfile() when the transport allows it
+            f = self.body
+            count = None
+            if isinstance(f, LazyFile):
+                offset = f.offset
+                count = f.remaining if f.remaining >= 0 else None
+                f = f._open()
+            else:
+                offset = f.tell() if hasattr(f, 'tell') else 0
+            self.bytes_written += await asyncio.get_running_loop().sendfile(
+                transport, f, offset, count)
+            self.write_count += 1
+            return
+
+        # other streams copy the data they are given, so a single buffer is
+        # reused for the connection, and written with memoryview slices
+        buf = getattr(stream, 'send_file_buffer', None)
+        if buf is None:
+            try:
+                buf = bytearray(self.send_file_max_buffer_size)
+            except MemoryError:  # pragma: no cover
+                buf = bytearray(self.send_file_buffer_size)
+        while True:
+            n = self.body.readinto(buf)
+            if not n:
+                break
+            await stream.awrite(memoryview(buf)[:n] if n < len(buf) else buf)
+            self.write_count += 1
+            self.bytes_written += n
+            if n < len(buf):
+                break
+        try:
+            stream.send_file_buffer = buf
+        except AttributeError:  # pragma: no cover
+            pass
+
+    def make_conditional(self, req):
+        """Turn this response into a ``304 Not Modified`` response if the
+        request's ``If-None-Match`` or ``If-Modified-Since`` headers show that
+        the client already has the current version.
+
+        :param req: The request object.
+
+        This method is invoked by Microdot for all ``GET`` and ``HEAD``
+        requests, using the ``ETag`` and ``Last-Modified`` headers of the
+        response as validators.
+        """
+        if self.status_code != 200:
+            return self
+        not_modified = False
+        if_none_match = req.headers.get('If-None-Match')
+        if if_none_match is not None:
+            etag = self.headers.get('ETag')
+            if etag is not None:
+                etag = etag[2:] if etag.startswith('W/') else etag
+                for tag in if_none_match.split(','):
+                    tag = tag.strip()
+                    if tag == '*' or (tag[2:] if tag.startswith('W/')
+                                      else tag) == etag:
+                        not_modified = True
+                        break
+        else:
+            if_modified_since = req.headers.get('If-Modified-Since')
+            last_modified = self.headers.get('Last-Modified')
+            if if_modified_since is not None and last_modified is not None:
+                since = parse_http_date(if_modified_since)
+                modified = parse_http_date(last_modified)
+                not_modified = since is not None and modified is not None \
+                    and modified <= since
+        if not_modified:
+            self.status_code = 304
+            self.reason = 'Not Modified'
+            if hasattr(self.body, 'close'):
+                self.body.close()
+            self.body = b''
+        return self
+
+    def make_partial(self, req):
+        """Turn this response into a ``206 Partial Content`` response if the
+        request has a ``Range`` header with a single byte range, or into a
+        ``416 Range Not Satisfiable`` response if the range is invalid.
+
+        :param req: The request object.
+
+        This method is invoked by Microdot for all ``GET`` requests. Only
+        responses that include the ``Accept-Ranges: bytes`` header, such as
+        those returned by :meth:`send_file`, are affected. Requests with
+        multiple ranges or invalid ranges receive the complete response.
+        """
+        range_header = req.headers.get('Range')
+        if range_header is None or self.status_code != 200 or \
+                self.headers.get('Accept-Ranges') != 'bytes' or \
+                not isinstance(self.body, (bytes, LazyFile)):
+            return self
+        if_range = req.headers.get('If-Range')
+        if if_range is not None:
+            # the validator must match strongly, else the client's copy may
+            # be outdated and the whole file is sent
+            if_range = if_range.strip()
+            if if_range.startswith('W/') or \
+                    if_range not in (self.headers.get('ETag'),
+                                     self.headers.get('Last-Modified')):
+                return self
+        size = int(self.headers['Content-Length'])
+        spec = range_header.strip().split('=', 1)
+        if len(spec) != 2 or spec[0].strip().lower() != 'bytes' or \
+                ',' in spec[1] or '-' not in spec[1]:
+            return self
+        start, end = [pos.strip() for pos in spec[1].split('-', 1)]
+        if (start and not start.isdigit()) or (end and not end.isdigit()) \
+                or not (start or end) or \
+                (start and end and int(end) < int(start)):
+            # invalid ranges are ignored
+            return self
+        if start == '':
+            # suffix range with the last bytes of the file
+            start = max(size - int(end), 0)
+            end = size - 1
+        else:
+            start = int(start)
+            end = min(int(end), size - 1) if end else size - 1
+        if hasattr(self.body, 'close'):
+            self.body.close()
+        if start > end or start >= size:
+            self.status_code = 416
+            self.reason = 'Range Not Satisfiable'
+            self.headers['Content-Range'] = 'bytes */{}'.format(size)
+            self.headers['Content-Length'] = '0'
+            self.body = b''
+            return self
+        self.status_code = 206
+        self.reason = 'Partial Content'
+        self.headers['Content-Range'] = 'bytes {}-{}/{}'.format(
+            start, end, size)
+        self.headers['Content-Length'] = str(end - start + 1)
+        if isinstance(self.body, bytes):
+            self.body = self.body[start:end + 1]
+        else:
+            self.body = LazyFile(self.body.filename, start, end - start + 1)
+        return self
+
     def body_iter(self):
         if hasattr(self.body, '__anext__'):
             # response body is an async generator
@@ -757,7 +1329,7 @@ class Response:
     @classmethod
     def send_file(cls, filename, status_code=200, content_type=None,
                   stream=None, max_age=None, compressed=False,
-                  file_extension=''):
+                  file_extension='', request=None):
         """Send file contents in a response.
 
         :param filename: The filename of the file.
@@ -784,6 +1356,25 @@ class Response:
                                parameter when opening the file, including the
                                dot. The extension given here is not considered
                                when generating the ``Content-Type`` header.
+        :param request: The request object. When given, a pre-compressed
+                        version of the file with a ``.gz`` extension is sent
+                        if it exists and the client accepts ``gzip`` encoding.
+                        The result of the check for the ``.gz`` file is
+                        cached in the ``gzip_files`` dictionary of the
+                        application. The plain file is sent if the ``.gz``
+                        file has been removed since, and a missing ``.gz``
+                        file is looked for again when the modification time
+                        of the plain file changes. A ``.gz`` file that is
+                        added without updating the plain file is used after
+                        the server is restarted or ``gzip_files`` is cleared.
+
+        When the file is read from storage, ``ETag`` and ``Last-Modified``
+        headers are generated from its size and modification time, so that
+        requests that include ``If-None-Match`` or ``If-Modified-Since``
+        validators receive a ``304`` response without the file being opened.
+        Single byte ``Range`` requests are answered with ``206`` responses
+        that seek to the requested part of the file. The ``ETag`` is strong,
+        so either validator can be given in an ``If-Range`` header.
 
         Security note: The filename is assumed to be trusted. Never pass
         filenames provided by the user without validating and sanitizing them
@@ -809,8 +1400,86 @@ class Response:
             headers['Content-Encoding'] = compressed \
                 if isinstance(compressed, str) else 'gzip'
 
-        f = stream or open(filename + file_extension, 'rb')
-        return cls(body=f, status_code=status_code, headers=headers)
+        if stream is None:
+            path = filename + file_extension
+            st = None
+            if request is not None and not compressed:
+                gzip_files = request.app.gzip_files
+                found, st = cls._has_gzip_file(gzip_files, path)
+                if found:
+                    headers['Vary'] = 'Accept-Encoding'
+                    if cls._accepts_gzip(request):
+                        try:
+                            gz_st = os.stat(path + '.gz')
+                        except OSError:
+                            # the .gz file was removed after it was found,
+                            # so the plain file is sent and the check is
+                            # repeated on the next request
+                            gzip_files.pop(path, None)
+                        else:
+                            path += '.gz'
+                            st = gz_st
+                            headers['Content-Encoding'] = 'gzip'
+            if st is None:
+                st = os.stat(path)
+            # a known length allows the connection to be kept alive
+            headers['Content-Length'] = str(st[6])
+            headers['ETag'] = '"{:x}-{:x}"'.format(st[6], int(st[8]))
+            headers['Last-Modified'] = http_date(st[8])
+            headers['Accept-Ranges'] = 'bytes'
+            if cls.file_cache is not None:
+                stream = cls.file_cache.get(path, st)
+            if stream is None:
+                # the file is not opened until the body is sent, so that
+                # conditional requests do not need to access it
+                stream = LazyFile(path)
+        return cls(body=stream, status_code=status_code, headers=headers)
+
+    @staticmethod
+    def _has_gzip_file(gzip_files, path):
+        # a .gz file that was found is checked again when it is sent, while
+        # a missing one is looked for again when the plain file changes,
+        # with its modification time stored in place of the result
+        found = gzip_files.get(path)
+        if found is True:
+            return True, None
+        # a missing plain file raises here, so that requests for missing
+        # files cannot grow the cache
+        st = os.stat(path)
+        if found != st[8]:
+            try:
+                os.stat(path + '.gz')
+                found = True
+            except OSError:
+                found = st[8]
+            gzip_files[path] = found
+        return found is True, st
+
+    @staticmethod
+    def _accepts_gzip(request):
+        # an explicit gzip entry takes precedence over a wildcard, wherever
+        # they appear in the header
+        gzip = star = None
+        for coding in request.headers.get('Accept-Encoding', '').split(','):
+            params = coding.split(';')
+            name = params[0].strip().lower()
+            if name not in ('gzip', '*'):
+                continue
+            q = 1.0
+            for param in params[1:]:
+                param = param.strip()
+                if param.startswith('q='):
+                    try:
+                        q = float(param[2:])
+                    except ValueError:
+                        q = 0.0
+            if name == 'gzip':
+                gzip = q
+            else:
+                star = q
+        if gzip is None:
+            gzip = star
+        return gzip is not None and gzip > 0
 
 
 class URLPattern():
@@ -883,6 +1552,141 @@ class URLPattern():
         return 'URLPattern: {}'.format(self.url_pattern)
 
 
+class RouteIndex:
+    """A segment tree that indexes the routes of a URL map.
+
+    :param url_map: The URL map to index, as stored in a
+                    :class:`Microdot` instance.
+    :param version: The version of the URL map that is indexed.
+
+    Literal path segments are found with a dictionary lookup at each level of
+    the tree, while ``string``, ``int`` and ``path`` segments are stored as
+    typed edges. Routes that use regular expression or custom segment types
+    are matched with their own regular expression. Lookups return all the
+    routes that match a path, in the order in which they appear in the URL
+    map, so that route priorities are preserved.
+    """
+    tree_types = {
+        'string': '/([^/]+)',
+        'int': '/(-?\\d+)',
+        'path': '/(.+)',
+    }
+    int_regex = re.compile('^-?\\d+$')
+
+    def __init__(self, url_map, version=0):
+        self.size = len(url_map)
+        self.version = version
+        self.root = self._node()
+        self.regex_routes = []
+        for index, route in enumerate(url_map):
+            self.add(index, route[1])
+
+    @staticmethod
+    def _node():
+        # literal children, typed edges and routes that end at this node
+        return ({}, [], [])
+
+    def add(self, index, url_pattern):
+        """Add a route to the index.
+
+        :param index: The position of the route in the URL map.
+        :param url_pattern: The :class:`URLPattern` instance of the route.
+        """
+        segments = []
+        names = []
+        for segment in url_pattern.url_pattern.lstrip('/').split('/'):
+            if segment and segment[0] == '<':
+                if segment[-1] != '>':
+                    raise ValueError('invalid URL pattern')
+                segment = segment[1:-1]
+                if ':' in segment:
+                    type_, name = segment.rsplit(':', 1)
+                else:
+                    type_ = 'string'
+                    name = segment
+                if type_ not in self.tree_types or \
+                        URLPattern.segment_patterns.get(type_) != \
+                        self.tree_types[type_]:
+                    self.regex_routes.append((index, url_pattern))
+                    return
+                segments.append((type_,))
+                names.append(name)
+            else:
+                segments.append(segment)
+        node = self.root
+        for segment in segments:
+            if isinstance(segment, str):
+                if segment not in node[0]:
+                    node[0][segment] = self._node()
+                node = node[0][segment]
+            else:
+                for type_, child in node[1]:
+                    if type_ == segment[0]:
+                        node = child
+                        break
+                else:
+                    child = self._node()
+                    node[1].append((segment[0], child))
+                    node = child
+        node[2].append((index, names))
+        self.size = max(self.size, index + 1)
+
+    def match(self, path):
+        """Return a list of ``(index, url_args)`` tuples for all the routes
+        that match the given path, sorted by their position in the URL map.
+
+        :param path: The path portion of the request URL.
+        """
+        matches = []
+        if path[:1] == '/':
+            self._match(self.root, path[1:].split('/'), 0, [], matches)
+        for index, url_pattern in self.regex_routes:
+            args = url_pattern.match(path)
+            if args is not None:
+                matches.append((index, args))
+        if len(matches) > 1:
+            matches.sort(key=lambda m: m[0])
+            unique = [matches[0]]
+            for m in matches[1:]:
+                if m[0] != unique[-1][0]:
+                    unique.append(m)
+            matches = unique
+        return matches
+
+    def _match(self, node, segments, i, values, matches):
+        if i == len(segments):
+            for index, names in node[2]:
+                matches.append((index, dict(zip(names, values))))
+            return
+        segment = segments[i]
+        child = node[0].get(segment)
+        if child is not None:
+            self._match(child, segments, i + 1, values, matches)
+        for type_, child in node[1]:
+            parser = URLPattern.segment_parsers.get(type_)
+            if type_ == 'path':
+                # try the longest paths first, to match the regex behavior
+                for j in range(len(segments), i, -1):
+                    value = '/'.join(segments[i:j])
+                    if value and parser:
+                        value = parser(value)
+                        if value is None:
+                            continue
+                    if value != '':
+                        self._match(child, segments, j, values + [value],
+                                    matches)
+                continue
+            if not segment or (type_ == 'int' and
+                               not self.int_regex.match(segment)):
+                continue
+            value = segment
+            if parser:
+                value = parser(segment)
+                if value is None:
+                    continue
+            self._match(child, segments, i + 1, values + [value], matches)
+
+
 class HTTPException(Exception):
     def __init__(self, status_code, reason=None):
         self.status_code = status_code
@@ -905,19 +1709,87 @@ class Microdot:
 
         app = Microdot()
     """
+    #: Enable HTTP/1.1 persistent connections. When set to ``True``, the
+    #: connection is kept open after a response is sent and additional
+    #: requests are read from the same socket, as negotiated by the
+    #: ``Connection`` header of each request. When ``False`` (the default),
+    #: the connection is closed after each response.
+    #:
+    #: Example::
+    #:
+    #:    app.keep_alive = True
+    keep_alive = False
+
+    #: The number of seconds a persistent connection can remain idle waiting
+    #: for the next request before it is closed. Set to ``None`` to wait
+    #: indefinitely. This timeout ends when the next request starts to
+    #: arrive. Its headers and body are then bounded by
+    #: ``Request.header_timeout`` and ``Request.body_timeout``.
+    keep_alive_timeout = 5
+
+    #: The maximum number of requests that are served on a single persistent
+    #: connection before it is closed. Set to 0 for no limit.
+    max_keep_alive_requests = 100
+
+    #: The maximum number of connections that are handled concurrently.
+    #: Connections above this limit receive a ``503`` response right after
+    #: the request headers are read, or after ``reject_timeout`` seconds.
+    #: Set to 0 for no limit.
+    max_connections = 0
+
+    #: The number of seconds sent in the ``Retry-After`` header of ``503``
+    #: responses.
+    retry_after = 5
+
+    #: The maximum number of seconds a connection above ``max_connections``
+    #: is given to send its request headers before the ``503`` response is
+    #: sent. This limit applies even when ``Request.header_timeout`` is
+    #: ``None``.
+    reject_timeout = 2
+
+    #: The maximum number of connections above ``max_connections`` that can
+    #: be receiving a ``503`` response at the same time. Connections beyond
+    #: this limit are closed without a response.
+    max_rejections = 4
 
     def __init__(self):
         self.url_map = []
+        self.routes_version = 0
+        self.route_index = None
         self.before_request_handlers = []
         self.after_request_handlers = []
         self.after_error_request_handlers = []
         self.error_handlers = {}
+        self.handlers_version = 0
+        self.handler_chains = {}
+        self.exception_handlers = {}
         self.shutdown_requested = False
         self.options_handler = self.default_options_handler
         self.debug = False
         self.server = None
-
-    def route(self, url_pattern, methods=None):
+        #: Connection counters for the server: ``active_connections``,
+        #: ``rejected_connections`` and ``timeouts``, the number of
+        #: connections closed because the client was idle or too slow.
+        self.server_stats = {'active_connections': 0,
+                             'rejected_connections': 0, 'timeouts': 0}
+        self.pending_rejections = 0
+        #: The concurrency state of the routes that have a
+        #: ``max_concurrency`` limit, indexed by URL pattern. Each entry is a
+        #: dictionary with ``max``, ``active`` and ``rejected`` keys, and the
+        #: ``methods`` the limit applies to.
+        self.route_limits = {}
+        #: The :class:`Metrics <microdot.metrics.Metrics>` instance that
+        #: records request statistics, or ``None`` if instrumentation is
+        #: disabled.
+        self.metrics = None
+        #: The :class:`LoopMonitor <microdot.loop_monitor.LoopMonitor>`
+        #: instance that measures the event loop lag, or ``None``.
+        self.loop_monitor = None
+        #: The results of the checks for pre-compressed ``.gz`` versions of
+        #: the files sent by :meth:`Response.send_file`, indexed by filename.
+        self.gzip_files = {}
+
+    def route(self, url_pattern, methods=None, max_concurrency=None):
         """Decorator that is used to register a function as a request handler
         for a given URL.
 
@@ -926,6 +1798,15 @@ class Microdot:
         :param methods: The list of HTTP methods to be handled by the
                         decorated function. If omitted, only ``GET`` requests
                         are handled.
+        :param max_concurrency: The maximum number of requests for this route
+                                that can be handled at the same time, such as
+                                open WebSocket sessions. Requests above the
+                                limit receive a ``503`` response as soon as
+                                the route is matched, before the before
+                                request handlers run. A request body of up
+                                to ``Request.max_body_length`` bytes has
+                                already been read at that point, but it is
+                                never parsed. If omitted, there is no limit.
 
         The URL pattern can be a static path (for example, ``/users`` or
         ``/api/invoices/search``) or a path with dynamic components enclosed
@@ -948,18 +1829,26 @@ class Microdot:
                 return 'Hello, world!'
         """
         def decorated(f):
+            route_methods = [m.upper() for m in (methods or ['GET'])]
+            if max_concurrency is not None:
+                self.route_limits[url_pattern] = {
+                    'max': max_concurrency, 'active': 0, 'rejected': 0,
+                    'methods': route_methods}
             self.url_map.append(
-                ([m.upper() for m in (methods or ['GET'])],
-                 URLPattern(url_pattern), f, '', None))
+                (route_methods, URLPattern(url_pattern), f, '', None))
+            self.routes_changed()
             return f
         return decorated
 
-    def get(self, url_pattern):
+    def get(self, url_pattern, max_concurrency=None):
         """Decorator that is used to register a function as a ``GET`` request
         handler for a given URL.
 
         :param url_pattern: The URL pattern that will be compared against
                             incoming requests.
+        :param max_concurrency: The maximum number of requests for this route
+                                that can be handled at the same time. See
+                                :meth:`route`.
 
         This decorator can be used as an alias to the ``route`` decorator with
         ``methods=['GET']``.
@@ -970,14 +1859,18 @@ class Microdot:
             def get_user(request, id):
                 # ...
         """
-        return self.route(url_pattern, methods=['GET'])
+        return self.route(url_pattern, methods=['GET'],
+                          max_concurrency=max_concurrency)
 
-    def post(self, url_pattern):
+    def post(self, url_pattern, max_concurrency=None):
         """Decorator that is used to register a function as a ``POST`` request
         handler for a given URL.
 
         :param url_pattern: The URL pattern that will be compared against
                             incoming requests.
+        :param max_concurrency: The maximum number of requests for this route
+                                that can be handled at the same time. See
+                                :meth:`route`.
 
         This decorator can be used as an alias to the``route`` decorator with
         ``methods=['POST']``.
@@ -988,14 +1881,18 @@ class Microdot:
             def create_user(request):
                 # ...
         """
-        return self.route(url_pattern, methods=['POST'])
+        return self.route(url_pattern, methods=['POST'],
+                          max_concurrency=max_concurrency)
 
-    def put(self, url_pattern):
+    def put(self, url_pattern, max_concurrency=None):
         """Decorator that is used to register a function as a ``PUT`` request
         handler for a given URL.
 
         :param url_pattern: The URL pattern that will be compared against
                             incoming requests.
+        :param max_concurrency: The maximum number of requests for this route
+                                that can be handled at the same time. See
+                                :meth:`route`.
 
         This decorator can be used as an alias to the ``route`` decorator with
         ``methods=['PUT']``.
@@ -1006,14 +1903,18 @@ class Microdot:
             def edit_user(request, id):
                 # ...
         """
-        return self.route(url_pattern, methods=['PUT'])
+        return self.route(url_pattern, methods=['PUT'],
+                          max_concurrency=max_concurrency)
 
-    def patch(self, url_pattern):
+    def patch(self, url_pattern, max_concurrency=None):
         """Decorator that is used to register a function as a ``PATCH`` request
         handler for a given URL.
 
         :param url_pattern: The URL pattern that will be compared against
                             incoming requests.
+        :param max_concurrency: The maximum number of requests for this route
+                                that can be handled at the same time. See
+                                :meth:`route`.
 
         This decorator can be used as an alias to the ``route`` decorator with
         ``methods=['PATCH']``.
@@ -1024,14 +1925,18 @@ class Microdot:
             def edit_user(request, id):
                 # ...
         """
-        return self.route(url_pattern, methods=['PATCH'])
+        return self.route(url_pattern, methods=['PATCH'],
+                          max_concurrency=max_concurrency)
 
-    def delete(self, url_pattern):
+    def delete(self, url_pattern, max_concurrency=None):
         """Decorator that is used to register a function as a ``DELETE``
         request handler for a given URL.
 
         :param url_pattern: The URL pattern that will be compared against
                             incoming requests.
+        :param max_concurrency: The maximum number of requests for this route
+                                that can be handled at the same time. See
+                                :meth:`route`.
 
         This decorator can be used as an alias to the ``route`` decorator with
         ``methods=['DELETE']``.
@@ -1042,7 +1947,8 @@ class Microdot:
             def delete_user(request, id):
                 # ...
         """
-        return self.route(url_pattern, methods=['DELETE'])
+        return self.route(url_pattern, methods=['DELETE'],
+                          max_concurrency=max_concurrency)
 
     def before_request(self, f):
         """Decorator to register a function to run before each request is
@@ -1056,6 +1962,7 @@ class Microdot:
                 # ...
         """
         self.before_request_handlers.append(f)
+        self.handlers_changed()
         return f
 
     def after_request(self, f):
@@ -1072,6 +1979,7 @@ class Microdot:
                 return response
         """
         self.after_request_handlers.append(f)
+        self.handlers_changed()
         return f
 
     def after_error_request(self, f):
@@ -1090,6 +1998,7 @@ class Microdot:
                 return response
         """
         self.after_error_request_handlers.append(f)
+        self.handlers_changed()
         return f
 
     def errorhandler(self, status_code_or_exception_class):
@@ -1115,6 +2024,7 @@ class Microdot:
         """
         def decorated(f):
             self.error_handlers[status_code_or_exception_class] = f
+            self.handlers_changed()
             return f
         return decorated
 
@@ -1132,6 +2042,9 @@ class Microdot:
             self.url_map.append(
                 (methods, URLPattern(url_prefix + pattern.url_pattern),
                  handler, url_prefix + _prefix, _subapp or subapp))
+        self.routes_changed()
+        for pattern, limit in subapp.route_limits.items():
+            self.route_limits[url_prefix + pattern] = limit
         if not local:
             for handler in subapp.before_request_handlers:
                 self.before_request_handlers.append(handler)
@@ -1145,6 +2058,8 @@ class Microdot:
             for status_code, handler in subapp.error_handlers.items():
                 self.error_handlers[status_code] = handler
             subapp.error_handlers = {}
+            self.handlers_changed()
+            subapp.handlers_changed()
 
     @staticmethod
     def abort(status_code, reason=None):
@@ -1236,6 +2151,8 @@ class Microdot:
         except TypeError:  # pragma: no cover
             self.server = await asyncio.start_server(serve, host, port)
 
+        if self.loop_monitor:
+            self.loop_monitor.start()
         while True:
             try:
                 if hasattr(self.server, 'serve_forever'):  # pragma: no cover
@@ -1249,6 +2166,8 @@ class Microdot:
                 # the task hasn't been initialized in the server object yet
                 # wait a bit and try again
                 await asyncio.sleep(0.1)
+        if self.loop_monitor:
+            self.loop_monitor.stop()
 
     def run(self, host='0.0.0.0', port=5000, debug=False, ssl=None):
         """Start the web server. This function does not normally return, as
@@ -1299,6 +2218,26 @@ class Microdot:
         """
         self.server.close()
 
+    def routes_changed(self):
+        """Invalidate the route index of the application.
+
+        This method is called by the decorators that register routes and by
+        :func:`mount`. Applications that modify the ``url_map`` list directly
+        must call it afterwards.
+        """
+        self.routes_version += 1
+
+    def get_route_index(self):
+        """Return the :class:`RouteIndex` for the application's URL map.
+
+        The index is rebuilt when the URL map has changed, as reported by
+        :func:`routes_changed`.
+        """
+        if self.route_index is None or \
+                self.route_index.version != self.routes_version:
+            self.route_index = RouteIndex(self.url_map, self.routes_version)
+        return self.route_index
+
     def find_route(self, req):
         method = req.method.upper()
         if method == 'OPTIONS' and self.options_handler:
@@ -1308,58 +2247,212 @@ class Microdot:
         f = 404
         p = ''
         s = None
-        for route_methods, route_pattern, route_handler, url_prefix, subapp \
-                in self.url_map:
-            req.url_args = route_pattern.match(req.path)
-            if req.url_args is not None:
-                p = url_prefix
-                s = subapp
-                if method in route_methods:
-                    f = route_handler
-                    break
-                else:
-                    f = 405
+        req.url_args = None
+        for index, url_args in self.get_route_index().match(req.path):
+            route_methods, _, route_handler, url_prefix, subapp = \
+                self.url_map[index]
+            req.url_args = url_args
+            p = url_prefix
+            s = subapp
+            if method in route_methods:
+                f = route_handler
+                req.url_pattern = self.url_map[index][1].url_pattern
+                break
+            else:
+                f = 405
         return f, p, s
 
     def default_options_handler(self, req):
         allow = []
-        for route_methods, route_pattern, _, _, _ in self.url_map:
-            if route_pattern.match(req.path) is not None:
-                allow.extend(route_methods)
+        for index, _ in self.get_route_index().match(req.path):
+            allow.extend(self.url_map[index][0])
         if 'GET' in allow:
             allow.append('HEAD')
         allow.append('OPTIONS')
         return {'Allow': ', '.join(allow)}
 
     async def handle_request(self, reader, writer):
-        req = None
+        if self.max_connections and self.server_stats[
+                'active_connections'] >= self.max_connections:
+            self.server_stats['rejected_connections'] += 1
+            await self.reject_connection(reader, writer)
+            return
+        self.server_stats['active_connections'] += 1
         try:
-            req = await Request.create(self, reader, writer,
-                                       writer.get_extra_info('peername'))
-        except Exception as exc:  # pragma: no cover
-            print_exception(exc)
+            await self.handle_connection(reader, writer)
+        finally:
+            self.server_stats['active_connections'] -= 1
+
+    async def reject_connection(self, reader, writer):
+        """Send a ``503`` response to a connection that exceeds the
+        ``max_connections`` limit. The request headers are read for up to
+        ``reject_timeout`` seconds before the response is sent, but the
+        request is not parsed and its body is ignored. When
+        ``max_rejections`` connections are already being rejected, the
+        connection is closed without a response."""
+        async def read_headers():
+            while (await Request._safe_readline(reader)).strip():
+                pass
+
+        self.pending_rejections += 1
+        try:
+            if self.pending_rejections <= self.max_rejections:
+                try:
+                    await wait_for(read_headers(), self.reject_timeout)
+                except (asyncio.TimeoutError, ValueError):
+                    # the client is too slow or the headers are invalid,
+                    # but the response is sent anyway
+                    pass
+                await writer.awrite(
+                    'HTTP/1.0 503 Service Unavailable\r\n'
+                    'Retry-After: {}\r\nContent-Length: 0\r\n\r\n'.format(
+                        self.retry_after).encode())
+        except Exception:  # pragma: no cover
+            pass
+        finally:
+            self.pending_rejections -= 1
+            try:
+                await writer.aclose()
+            except Exception:  # pragma: no cover
+                pass
 
-        res = await self.dispatch_request(req)
+    async def handle_connection(self, reader, writer):
+        request_count = 0
+        keep_alive = True
+        metrics = self.metrics
+        if Request.buffered_parser:
+            # data read past the headers of a request belongs to its body or
+            # to the next request, so the buffer is kept for the connection
+            reader = BufferedStream(reader)
+        while keep_alive:
+            req = None
+            try:
+                req = await Request.create(self, reader, writer,
+                                           writer.get_extra_info('peername'),
+                                           keep_alive=request_count > 0)
+            except asyncio.TimeoutError:
+                # the client was too slow to send the request, or the
+                # persistent connection has been idle for too long
+                self.server_stats['timeouts'] += 1
+                break
+            except OSError as exc:  # pragma: no cover
+                if request_count and exc.errno in MUTED_SOCKET_ERRORS:
+                    # the client dropped the persistent connection
+                    break
+                print_exception(exc)
+            except Exception as exc:  # pragma: no cover
+                print_exception(exc)
+            else:
+                if req is None and request_count:
+                    # the client closed the persistent connection
+                    break
+            request_count += 1
+
+            if metrics:
+                handler_start = ticks_us()
+            res = await self.dispatch_request(req)
+            if metrics:
+                write_start = ticks_us()
+            keep_alive = False
+            try:
+                if res != Response.already_handled:  # pragma: no branch
+                    if self.keep_alive:
+                        keep_alive = self._keep_alive(req, res, request_count)
+                    await res.write(writer)
+            except OSError as exc:  # pragma: no cover
+                if exc.errno in MUTED_SOCKET_ERRORS:
+                    keep_alive = False
+                else:
+                    raise
+            if metrics:
+                metrics.record(req, res,
+                               ticks_diff(write_start, handler_start),
+                               ticks_diff(ticks_us(), write_start))
+            if self.debug and req:  # pragma: no cover
+                print('{method} {path} {status_code}'.format(
+                    method=req.method, path=req.path,
+                    status_code=res.status_code))
         try:
-            if res != Response.already_handled:  # pragma: no branch
-                await res.write(writer)
             await writer.aclose()
         except OSError as exc:  # pragma: no cover
             if exc.errno in MUTED_SOCKET_ERRORS:
                 pass
             else:
                 raise
-        if self.debug and req:  # pragma: no cover
-            print('{method} {path} {status_code}'.format(
-                method=req.method, path=req.path,
-                status_code=res.status_code))
+
+    def _keep_alive(self, req, res, request_count):
+        """Decide if the connection can be reused after the given response,
+        and add the corresponding ``Connection`` header to it."""
+        if req is None:
+            return False
+        connection = req.headers.get('Connection', '').lower()
+        if req.http_version == '1.1':
+            res.http_version = '1.1'
+            keep_alive = 'close' not in connection
+        else:
+            keep_alive = 'keep-alive' in connection
+        if keep_alive:
+            res.complete()
+            if self.max_keep_alive_requests and \
+                    request_count >= self.max_keep_alive_requests:
+                keep_alive = False
+            elif req.content_length > Request.max_body_length:
+                # the body may not have been fully read from the socket
+                keep_alive = False
+            elif 'Content-Length' not in res.headers and not res.is_head \
+                    and res.status_code not in (204, 304):
+                # the end of the body can only be signaled by closing
+                keep_alive = False
+        if keep_alive:
+            res.headers['Connection'] = 'keep-alive'
+        elif req.http_version == '1.1':
+            res.headers['Connection'] = 'close'
+        return keep_alive
+
+    def handlers_changed(self):
+        """Invalidate the cached handler chains of the application.
+
+        This method is called by the decorators that register request and
+        error handlers. Applications that modify the handler lists or the
+        ``error_handlers`` dictionary directly must call it afterwards.
+        """
+        self.handlers_version += 1
+        self.handler_chains = {}
+        self.exception_handlers = {}
 
     def get_request_handlers(self, req, attr, local_first=True):
-        handlers = getattr(self, attr + '_handlers')
-        local_handlers = getattr(req.subapp, attr + '_handlers') \
-            if req and req.subapp else []
-        return local_handlers + handlers if local_first \
-            else handlers + local_handlers
+        subapp = req.subapp if req else None
+        local_version = subapp.handlers_version if subapp else 0
+        key = (attr, subapp, local_first)
+        chain = self.handler_chains.get(key)
+        if chain is None or chain[0] != local_version:
+            handlers = tuple(getattr(self, attr + '_handlers'))
+            local_handlers = tuple(getattr(subapp, attr + '_handlers')) \
+                if subapp else ()
+            chain = (local_version, local_handlers + handlers if local_first
+                     else handlers + local_handlers)
+            self.handler_chains[key] = chain
+        return chain[1]
+
+    def get_exception_handler(self, req, exc_class):
+        subapp = req.subapp if req else None
+        local_version = subapp.handlers_version if subapp else 0
+        key = (subapp, exc_class)
+        entry = self.exception_handlers.get(key)
+        if entry is None or entry[0] != local_version:
+            handler = None
+            # walk up the exception class hierarchy to find a handler, giving
+            # priority to the handlers of the sub-application
+            for c in mro(exc_class):
+                if subapp and c in subapp.error_handlers:
+                    handler = subapp.error_handlers[c]
+                    break
+                elif c in self.error_handlers:
+                    handler = self.error_handlers[c]
+                    break
+            entry = (local_version, handler)
+            self.exception_handlers[key] = entry
+        return entry[1]
 
     async def error_response(self, req, status_code, reason=None):
         if req and req.subapp and status_code in req.subapp.error_handlers:
@@ -1378,20 +2471,41 @@ class Microdot:
             else:
                 # find the route in the app's URL map
                 f, req.url_prefix, req.subapp = self.find_route(req)
+                if self.loop_monitor:
+                    self.loop_monitor.mark(req.url_pattern or req.path)
 
                 try:
                     res = None
                     if callable(f):
-                        # invoke the before request handlers
-                        for handler in self.get_request_handlers(
-                                req, 'before_request', False):
-                            res = await invoke_handler(handler, req)
-                            if res:
-                                break
-
-                        # invoke the endpoint handler
-                        if res is None:
-                            res = await invoke_handler(f, req, **req.url_args)
+                        # the concurrency limit of the route is checked
+                        # before any handler runs
+                        limit = self.route_limits.get(req.url_pattern)
+                        method = req.method.upper()
+                        if limit is not None and ('GET' if method == 'HEAD'
+                                                  else method) \
+                                not in limit['methods']:
+                            # the limit is for other methods of the pattern
+                            limit = None
+                        if limit is not None:
+                            if limit['active'] >= limit['max']:
+                                limit['rejected'] += 1
+                                raise HTTPException(503, 'Service unavailable')
+                            limit['active'] += 1
+                        try:
+                            # invoke the before request handlers
+                            for handler in self.get_request_handlers(
+                                    req, 'before_request', False):
+                                res = await invoke_handler(handler, req)
+                                if res:
+                                    break
+
+                            # invoke the endpoint handler
+                            if res is None:
+                                res = await invoke_handler(
+                                    f, req, **req.url_args)
+                        finally:
+                            if limit is not None:
+                                limit['active'] -= 1
 
                         # process the response
                         if isinstance(res, int):
@@ -1449,23 +2563,8 @@ class Microdot:
 
                     # invoke the error handler for the exception class if one
                     # exists
-                    handler = None
                     res = None
-                    if req.subapp and exc.__class__ in \
-                            req.subapp.error_handlers:
-                        handler = req.subapp.error_handlers[exc.__class__]
-                    elif exc.__class__ in self.error_handlers:
-                        handler = self.error_handlers[exc.__class__]
-                    else:
-                        # walk up the exception class hierarchy to try to find
-                        # a handler
-                        for c in mro(exc.__class__)[1:]:
-                            if req.subapp and c in req.subapp.error_handlers:
-                                handler = req.subapp.error_handlers[c]
-                                break
-                            elif c in self.error_handlers:
-                                handler = self.error_handlers[c]
-                                break
+                    handler = self.get_exception_handler(req, exc.__class__)
                     if handler:
                         try:
                             res = await invoke_handler(handler, req, exc)
@@ -1482,6 +2581,8 @@ class Microdot:
             res = Response(*res)
         elif not isinstance(res, Response):
             res = Response(res)
+        if res.status_code == 503 and 'Retry-After' not in res.headers:
+            res.headers['Retry-After'] = str(self.retry_after)
         if not after_request_handled:
             # if the request did not finish due to an error, invoke the after
             # error request handler
@@ -1489,6 +2590,10 @@ class Microdot:
                     req, 'after_error_request', True):
                 res = await invoke_handler(
                     handler, req, res) or res
+        if req and req.method in ('GET', 'HEAD'):
+            res.make_conditional(req)
+            if req.method == 'GET':
+                res.make_partial(req)
         res.is_head = (req and req.method == 'HEAD')
         return res
 
@@ -32,6 +32,9 @@ class TestResponse:
         #: The body of the JSON response, decoded to a dictionary or list. Set
         #: ``Note`` if the response does not have a JSON payload.
         self.json = None
+        #: The number of stream writes issued by the server to send the
+        #: response.
+        self.write_count = None
 
     def _initialize_response(self, res):
         self.status_code = res.status_code
@@ -39,14 +42,12 @@ class TestResponse:
         self.headers = res.headers
 
     async def _initialize_body(self, res):
-        self.body = b''
-        iter = res.body_iter()
-        async for body in iter:  # pragma: no branch
-            if isinstance(body, str):
-                body = body.encode()
-            self.body += body
-        if hasattr(iter, 'aclose'):  # pragma: no branch
-            await iter.aclose()
+        stream = AsyncBytesIO(b'')
+        await res.write(stream)
+        self.write_count = res.write_count
+        if not res.is_head:
+            data = stream.stream.getvalue()
+            self.body = data[data.find(b'\r\n\r\n') + 4:]
 
     def _process_text_body(self):
         try:
@@ -64,8 +65,8 @@ class TestResponse:
     async def create(cls, res):
         test_res = cls()
         test_res._initialize_response(res)
+        await test_res._initialize_body(res)
         if not res.is_head:
-            await test_res._initialize_body(res)
             test_res._process_text_body()
             test_res._process_json_body()
         return test_res
@@ -134,12 +135,12 @@ class TestClient:
         return headers
 
     def _render_request(self, method, path, headers, body):
-        request_bytes = '{method} {path} HTTP/1.0\n'.format(
+        request_bytes = '{method} {path} HTTP/1.0\r\n'.format(
             method=method, path=path)
         for header, value in headers.items():
-            request_bytes += '{header}: {value}\n'.format(
+            request_bytes += '{header}: {value}\r\n'.format(
                 header=header, value=value)
-        request_bytes = request_bytes.encode() + b'\n' + body
+        request_bytes = request_bytes.encode() + b'\r\n' + body
         return request_bytes
 
     def _update_cookies(self, res):
@@ -1,9 +1,30 @@
+import asyncio
 import binascii
 import hashlib
+import io
 from microdot import Request, Response
-from microdot.microdot import MUTED_SOCKET_ERRORS, print_exception
+from microdot.microdot import MUTED_SOCKET_ERRORS, print_exception, \
+    wait_for
 from microdot.helpers import wraps
 
+try:
+    from microdot.ws_mask import xor_mask as _xor_mask
+except (ImportError, SyntaxError):  # pragma: no cover
+    # CPython, or a MicroPython port built without the viper emitter
+    _xor_mask = None
+
+try:
+    import zlib
+    if not hasattr(zlib, 'compressobj'):  # pragma: no cover
+        zlib = None
+except ImportError:  # pragma: no cover
+    zlib = None
+
+try:
+    import deflate
+except ImportError:
+    deflate = None
+
 
 class WebSocketError(Exception):
     """Exception raised when an error occurs in a WebSocket connection."""
@@ -35,47 +56,296 @@ class WebSocket:
     #:    WebSocket.max_message_length = 4 * 1024  # up to 4KB messages
     max_message_length = -1
 
+    #: Specify the maximum number of seconds to wait for a frame from the
+    #: client when calling the ``receive()`` method. When the timeout expires
+    #: the connection is closed, so that stalled clients release their
+    #: resources. Set to ``None`` (the default) to wait indefinitely.
+    #:
+    #: Example::
+    #:
+    #:    WebSocket.read_timeout = 60  # close after 1 minute of silence
+    read_timeout = None
+
+    #: Specify the maximum number of seconds allowed to receive the rest of
+    #: a frame once its header has arrived. When the timeout expires the
+    #: connection is closed, so that a client that stalls in the middle of
+    #: a frame does not keep its buffers. Set to ``None`` for no limit.
+    frame_timeout = 10
+
+    #: Accept the ``permessage-deflate`` extension when clients offer it,
+    #: to compress the messages in both directions. The default is
+    #: ``False``.
+    #:
+    #: Example::
+    #:
+    #:    WebSocket.permessage_deflate = True
+    permessage_deflate = False
+
+    #: The largest LZ77 window, as a power of two, that is used by the
+    #: server and allowed to the client when compressing messages. Smaller
+    #: windows use less memory but compress less. The range is 9 to 15.
+    deflate_window_bits = 12
+
+    #: Keep the compression context between messages, which improves the
+    #: compression of similar messages but keeps the compressor and
+    #: decompressor state in memory for the life of the connection. When
+    #: set to ``False``, or when the ``zlib`` module is not available and
+    #: the ``deflate`` module is used instead, each message is compressed
+    #: on its own.
+    deflate_context_takeover = True
+
+    #: Messages shorter than this number of bytes are sent uncompressed,
+    #: as compressing them saves little or nothing.
+    deflate_min_size = 32
+
+    #: The maximum number of seconds :meth:`close` waits for the messages
+    #: in the send queue to be written, and then for the frame that is being
+    #: written to complete, before it sends the close frame.
+    close_timeout = 2
+
     def __init__(self, request):
         self.request = request
         self.closed = False
+        #: The :class:`PerMessageDeflate` state of the connection, or
+        #: ``None`` if compression was not negotiated.
+        self.deflate = None
+        #: The :class:`SendQueue` of the connection, or ``None`` if messages
+        #: are written as they are sent.
+        self.send_queue = None
+        # frames are written by the handler, the send queue and the hub, so
+        # each one is written under this lock to keep them from interleaving
+        self.write_lock = asyncio.Lock()
+        self.close_sent = False
 
     async def handshake(self):
         response = self._handshake_response()
+        extensions = b''
+        if self.permessage_deflate:
+            offer = self.request.headers.get('Sec-WebSocket-Extensions')
+            if offer:
+                self.deflate, agreed = PerMessageDeflate.negotiate(
+                    offer, self.deflate_window_bits,
+                    self.deflate_context_takeover)
+                if self.deflate:
+                    extensions = b'Sec-WebSocket-Extensions: ' + \
+                        agreed.encode() + b'\r\n'
         await self.request.sock[1].awrite(
             b'HTTP/1.1 101 Switching Protocols\r\n')
         await self.request.sock[1].awrite(b'Upgrade: websocket\r\n')
         await self.request.sock[1].awrite(b'Connection: Upgrade\r\n')
         await self.request.sock[1].awrite(
-            b'Sec-WebSocket-Accept: ' + response + b'\r\n\r\n')
+            extensions + b'Sec-WebSocket-Accept: ' + response +
+            b'\r\n\r\n')
 
     async def receive(self):
-        """Receive a message from the client."""
+        """Receive a message from the client.
+
+        Messages sent in several fragments are reassembled, and the total
+        size of the fragments is limited by ``max_message_length``.
+        """
+        fragments = None
         while True:
-            opcode, payload = await self._read_frame()
-            send_opcode, data = self._process_websocket_frame(opcode, payload)
-            if send_opcode:  # pragma: no cover
-                await self.send(data, send_opcode)
-            elif data:  # pragma: no branch
+            fin, opcode, payload, compressed = await self._read(
+                self._read_frame(), self.read_timeout)
+            self._mark()
+            if opcode & 0x08:
+                # control frames can arrive in between fragments
+                send_opcode, data = self._process_websocket_frame(
+                    opcode, payload)
+                if send_opcode:  # pragma: no cover
+                    await self.send(data, send_opcode)
+                continue
+            if opcode == self.CONT:
+                if fragments is None:
+                    raise WebSocketError('Unexpected continuation frame')
+                size += len(payload)
+                max_length = self._max_length()
+                if max_length and size > max_length:
+                    raise WebSocketError('Message too large')
+                fragments.append(payload)
+                if not fin:
+                    continue
+                opcode = message_opcode
+                compressed = message_compressed
+                payload = b''.join(fragments)
+                fragments = None
+            elif fragments is not None:
+                raise WebSocketError('Expected continuation frame')
+            elif not fin:
+                fragments = [payload]
+                size = len(payload)
+                message_opcode = opcode
+                message_compressed = compressed
+                continue
+            if compressed:
+                payload = self.deflate.decompress(payload,
+                                                  self._max_length())
+            _, data = self._process_websocket_frame(opcode, payload)
+            if data:  # pragma: no branch
                 return data
 
-    async def send(self, data, opcode=None):
+    def receive_stream(self, chunk_size=1024, max_length=0):
+        """Receive a message from the client in chunks.
+
+        :param chunk_size: The maximum size of the chunks, in bytes.
+        :param max_length: The maximum size of the message. Set to 0 (the
+                           default) for no limit, or to -1 to use
+                           ``max_message_length``.
+
+        This method returns an asynchronous iterator that returns the payload
+        of the next message in chunks of bytes as they are received, so that
+        large messages are never held in memory in full. Control frames that
+        arrive in between fragments are handled as in :meth:`receive`.
+        Compressed messages are decompressed as they arrive when the
+        ``zlib`` module supports it, or else rejected.
+        Example::
+
+            @app.route('/upload')
+            @with_websocket
+            async def upload(request, ws):
+                with open('upload.bin', 'wb') as f:
+                    async for chunk in ws.receive_stream():
+                        f.write(chunk)
+        """
+        return WebSocketStream(self, chunk_size, self._max_length()
+                               if max_length == -1 else max_length)
+
+    async def _read(self, awaitable, timeout):
+        try:
+            return await wait_for(awaitable, timeout)
+        except asyncio.TimeoutError:
+            self.request.app.server_stats['timeouts'] += 1
+            raise WebSocketError('Websocket read timeout')
+        except EOFError:  # pragma: no cover
+            raise WebSocketError('Websocket connection closed')
+
+    def _max_length(self):
+        return Request.max_body_length if self.max_message_length == -1 \
+            else self.max_message_length
+
+    async def send(self, data, opcode=None, key=None):
         """Send a message to the client.
 
         :param data: the data to send, given as a string or bytes.
         :param opcode: a custom frame opcode to use. If not given, the opcode
                        is ``TEXT`` or ``BINARY`` depending on the type of the
                        data.
+        :param key: the key of the message, used by send queues with the
+                    ``COALESCE_LATEST`` policy to replace pending messages
+                    that have the same key. Messages without a key are
+                    never replaced.
+
+        When a send queue is enabled with :meth:`enable_send_queue`, data
+        messages are queued and this method returns without waiting for
+        them to be written.
+        """
+        self._mark()
+        opcode = opcode or (self.TEXT if isinstance(data, str)
+                            else self.BINARY)
+        if self.send_queue is not None and not opcode & 0x08:
+            if self.send_queue.error is not None:
+                raise WebSocketError('Websocket connection closed')
+            if not isinstance(data, (bytes, str)):
+                # the caller may reuse its buffer before the message is
+                # written
+                data = bytes(data)
+            self.send_queue.put(data, opcode, key)
+            return
+        await self._write(self._frame(opcode, data))
+
+    def enable_send_queue(self, size=8, policy='drop-oldest',
+                          high_water=None, on_high_water=None):
+        """Queue the messages sent to the client, and write them from a
+        separate task.
+
+        :param size: The maximum number of messages in the queue.
+        :param policy: What to do when a message is sent and the queue is
+                       full. ``'drop-oldest'`` drops the oldest message in
+                       the queue, ``'drop-newest'`` drops the message being
+                       sent, and ``'coalesce-latest'`` replaces the queued
+                       message that has the same key as the one being sent,
+                       or drops the oldest one if there is none. Messages
+                       sent without a key are never replaced.
+        :param high_water: The queue depth at which ``on_high_water`` is
+                           called. The default is the size of the queue.
+        :param on_high_water: A function that is called with the WebSocket
+                              and the queue depth when the queue reaches the
+                              high water mark. It is called again only after
+                              the queue is emptied.
+
+        With a send queue, a slow client does not block the task that sends
+        to it, and the memory used by its unsent messages is bounded. Only
+        data messages are queued, control messages are written immediately,
+        in between the queued messages.
+        Example::
+
+            @app.route('/ws')
+            @with_websocket
+            async def telemetry(request, ws):
+                # keep only the latest reading for slow clients
+                ws.enable_send_queue(2, 'coalesce-latest')
+                while True:
+                    await ws.send(json.dumps(sampler.values()),
+                                  key='telemetry')
+                    await asyncio.sleep(0.1)
         """
-        frame = self._encode_websocket_frame(
-            opcode or (self.TEXT if isinstance(data, str) else self.BINARY),
-            data)
-        await self.request.sock[1].awrite(frame)
+        if self.send_queue is None:
+            self.send_queue = SendQueue(self, size, policy, high_water,
+                                        on_high_water)
+            self.send_queue.start()
+        return self.send_queue
+
+    def _frame(self, opcode, data):
+        compressed = None
+        if self.deflate and opcode in (self.TEXT, self.BINARY) and \
+                len(data) >= self.deflate_min_size:
+            compressed = self.deflate.compress(
+                data.encode() if isinstance(data, str) else data)
+        if compressed is not None:
+            data = compressed
+        return self._encode_websocket_frame(opcode, data,
+                                            compressed is not None)
+
+    def _mark(self):
+        # let the loop monitor know that this route is running
+        monitor = self.request.app.loop_monitor
+        if monitor:
+            monitor.mark(self.request.url_pattern)
+
+    async def _write(self, frame):
+        async with self.write_lock:
+            if self.close_sent:
+                raise WebSocketError('Websocket connection closed')
+            await self.request.sock[1].awrite(frame)
 
     async def close(self):
-        """Close the websocket connection."""
+        """Close the websocket connection.
+
+        The messages in the send queue are written first, for up to
+        ``close_timeout`` seconds. If a frame is still being written after
+        that, the close frame is sent once it completes, or not at all if
+        it does not complete within another ``close_timeout`` seconds.
+        """
         if not self.closed:  # pragma: no cover
             self.closed = True
-            await self.send(b'', self.CLOSE)
+            queue = self.send_queue
+            if queue is not None:
+                # deliver the queued messages before the close frame, then
+                # let the writer complete the frame it may be writing
+                await queue.drain(self.close_timeout)
+                queue.stop()
+            try:
+                await wait_for(self.write_lock.acquire(), self.close_timeout)
+            except asyncio.TimeoutError:
+                # the client is not reading, and a close frame written now
+                # would corrupt the frame that is being written
+                return
+            try:
+                self.close_sent = True
+                await self.request.sock[1].awrite(
+                    self._frame(self.CLOSE, b''))
+            finally:
+                self.write_lock.release()
 
     def _handshake_response(self):
         connection = False
@@ -103,8 +373,6 @@ class WebSocket:
     def _parse_frame_header(cls, header):
         fin = header[0] & 0x80
         opcode = header[0] & 0x0f
-        if fin == 0 or opcode == cls.CONT:  # pragma: no cover
-            raise WebSocketError('Continuation frames not supported')
         has_mask = header[1] & 0x80
         length = header[1] & 0x7f
         if length == 126:
@@ -127,10 +395,10 @@ class WebSocket:
         return None, payload
 
     @classmethod
-    def _encode_websocket_frame(cls, opcode, payload):
+    def _encode_websocket_frame(cls, opcode, payload, compressed=False):
         frame = bytearray()
-        frame.append(0x80 | opcode)
-        if opcode == cls.TEXT:
+        frame.append(0x80 | opcode | (0x40 if compressed else 0))
+        if isinstance(payload, str):
             payload = payload.encode()
         if len(payload) < 126:
             frame.append(len(payload))
@@ -143,27 +411,628 @@ class WebSocket:
         frame.extend(payload)
         return frame
 
-    async def _read_frame(self):
+    async def _read_frame_header(self, max_length):
         header = await self.request.sock[0].read(2)
         if len(header) != 2:  # pragma: no cover
             raise WebSocketError('Websocket connection closed')
         fin, opcode, has_mask, length = self._parse_frame_header(header)
         if length == -2:
-            length = await self.request.sock[0].read(2)
+            length = await self.request.sock[0].readexactly(2)
             length = int.from_bytes(length, 'big')
         elif length == -8:
-            length = await self.request.sock[0].read(8)
+            length = await self.request.sock[0].readexactly(8)
             length = int.from_bytes(length, 'big')
-        max_allowed_length = Request.max_body_length \
-            if self.max_message_length == -1 else self.max_message_length
-        if length > max_allowed_length:
+        if opcode & 0x08 and (not fin or length > 125):  # pragma: no cover
+            raise WebSocketError('Invalid control frame')
+        # the RSV1 bit marks the first frame of a compressed message
+        compressed = header[0] & 0x40
+        if compressed and (self.deflate is None or opcode & 0x08 or
+                           opcode == self.CONT):
+            raise WebSocketError('Unexpected compressed frame')
+        if max_length and length > max_length:
             raise WebSocketError('Message too large')
+        mask = None
         if has_mask:  # pragma: no cover
-            mask = await self.request.sock[0].read(4)
-        payload = await self.request.sock[0].read(length)
-        if has_mask:  # pragma: no cover
-            payload = bytes(x ^ mask[i % 4] for i, x in enumerate(payload))
-        return opcode, payload
+            mask = await self.request.sock[0].readexactly(4)
+        return fin, opcode, mask, length, compressed
+
+    async def _read_frame(self):
+        fin, opcode, mask, length, compressed = \
+            await self._read_frame_header(self._max_length())
+        payload = await self._read(self._read_payload(length, mask),
+                                   self.frame_timeout)
+        return fin, opcode, payload, compressed
+
+    async def _read_payload(self, length, mask):
+        stream = self.request.sock[0]
+        if mask and _xor_mask is not None and \
+                hasattr(stream, 'readinto'):  # pragma: no cover
+            # MicroPython: read into the buffer that is returned and unmask
+            # it in place, so that the payload is allocated only once
+            payload = bytearray(length)
+            view = memoryview(payload)
+            pos = 0
+            while pos < length:
+                n = await stream.readinto(view[pos:])
+                if not n:
+                    raise EOFError()
+                pos += n
+            _xor_mask(payload, length, mask)
+            return payload
+        payload = await stream.readexactly(length)
+        if mask:  # pragma: no cover
+            payload = self._unmask(payload, mask)
+        return payload
+
+    def _unmask(self, payload, mask):
+        n = len(payload)
+        if _xor_mask is not None:  # pragma: no cover
+            # MicroPython: copy the payload once and XOR it in place with
+            # native code
+            data = bytearray(payload)
+            _xor_mask(data, n, mask)
+            return data
+        # XOR the whole payload at once, as a big integer
+        key = mask * ((n >> 2) + 1)
+        return (int.from_bytes(payload, 'big') ^
+                int.from_bytes(key[:n], 'big')).to_bytes(n, 'big')
+
+
+class WebSocketStream:
+    """An asynchronous iterator that returns the payload of a WebSocket
+    message in chunks. Instances of this class are returned by
+    :meth:`WebSocket.receive_stream`."""
+    def __init__(self, ws, chunk_size, max_length):
+        self.ws = ws
+        self.chunk_size = chunk_size
+        self.max_length = max_length
+        #: The opcode of the message, ``TEXT`` or ``BINARY``. It is
+        #: available after the first chunk is returned.
+        self.opcode = None
+        #: The number of payload bytes received so far.
+        self.length = 0
+        self.fin = False
+        self.mask = None
+        self.offset = 0
+        self.remaining = 0
+        self.decompressor = None
+        self.pending = b''
+        self.flushed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        ws = self.ws
+        while True:
+            if self.pending:
+                # decompress the input that is left, a chunk at a time
+                data = self.decompressor.decompress(self.pending,
+                                                    self.chunk_size)
+                self.pending = self.decompressor.unconsumed_tail
+                if data:
+                    self.length += len(data)
+                    if self.max_length and self.length > self.max_length:
+                        raise WebSocketError('Message too large')
+                    return data
+                continue
+            if not self.remaining:
+                if self.fin:
+                    if self.decompressor is None or self.flushed:
+                        if self.decompressor is not None:
+                            ws.deflate.end_message()
+                        raise StopAsyncIteration
+                    # restore the end of the compressed data, which the
+                    # client removed
+                    self.flushed = True
+                    self.pending = PerMessageDeflate.tail
+                    continue
+                await self._read_frame_header()
+                continue
+            n = min(self.remaining, self.chunk_size)
+            data = await ws._read(ws.request.sock[0].readexactly(n),
+                                  ws.frame_timeout)
+            if self.mask:  # pragma: no cover
+                i = self.offset & 3
+                data = ws._unmask(data, self.mask[i:] + self.mask[:i])
+            self.offset += n
+            self.remaining -= n
+            if self.decompressor is not None:
+                self.pending = data
+                continue
+            self.length += n
+            return data
+
+    async def _read_frame_header(self):
+        ws = self.ws
+        while True:
+            fin, opcode, mask, length, compressed = await ws._read(
+                ws._read_frame_header(0), ws.read_timeout)
+            ws._mark()
+            if opcode & 0x08:
+                payload = await ws._read(ws.request.sock[0].readexactly(
+                    length), ws.frame_timeout)
+                if mask:  # pragma: no cover
+                    payload = ws._unmask(payload, mask)
+                send_opcode, data = ws._process_websocket_frame(
+                    opcode, payload)
+                if send_opcode:  # pragma: no cover
+                    await ws.send(data, send_opcode)
+                continue
+            if self.opcode is None:
+                if opcode == ws.CONT:
+                    raise WebSocketError('Unexpected continuation frame')
+                self.opcode = opcode
+                if compressed:
+                    self.decompressor = ws.deflate.get_decompressor()
+            elif opcode != ws.CONT:
+                raise WebSocketError('Expected continuation frame')
+            if self.decompressor is None and self.max_length and \
+                    self.length + length > self.max_length:
+                raise WebSocketError('Message too large')
+            self.fin = fin
+            self.mask = mask
+            self.offset = 0
+            self.remaining = length
+            return
+
+
+class PerMessageDeflate:
+    """The compression state of a WebSocket connection that uses the
+    ``permessage-deflate`` extension defined in RFC 7692.
+
+    :param server_bits: The window size, as a power of two, used to compress
+                        the messages sent to the client.
+    :param client_bits: The window size used by the client to compress its
+                        messages.
+    :param server_takeover: ``True`` to keep the compression context
+                            between the messages sent to the client.
+    :param client_takeover: ``True`` if the client keeps the compression
+                            context between its messages.
+
+    Instances of this class are created by :meth:`negotiate` during the
+    WebSocket handshake.
+    """
+    #: The empty block that ends the compressed data of each message, which
+    #: is not sent on the wire.
+    tail = b'\x00\x00\xff\xff'
+
+    def __init__(self, server_bits=15, client_bits=15, server_takeover=True,
+                 client_takeover=True):
+        self.server_bits = server_bits
+        self.client_bits = client_bits
+        self.server_takeover = server_takeover
+        self.client_takeover = client_takeover
+        self.compressor = None
+        self.decompressor = None
+
+    @classmethod
+    def negotiate(cls, offers, window_bits=15, context_takeover=True):
+        """Select the first acceptable ``permessage-deflate`` offer.
+
+        :param offers: The value of the ``Sec-WebSocket-Extensions`` header
+                       sent by the client.
+        :param window_bits: The largest window size to use, as a power of
+                            two.
+        :param context_takeover: ``False`` to compress each message on its
+                                 own in both directions.
+
+        The return value is a tuple with the new instance and the value of
+        the ``Sec-WebSocket-Extensions`` header of the response, or
+        ``(None, None)`` if no offer is acceptable.
+        """
+        if zlib is None:  # pragma: no cover
+            if deflate is None:
+                return None, None
+            # the deflate module cannot keep the context between messages
+            context_takeover = False
+        for offer in offers.split(','):
+            params = [p.strip() for p in offer.split(';')]
+            if params[0] != 'permessage-deflate':
+                continue
+            server_bits = window_bits
+            client_bits = None
+            server_takeover = client_takeover = context_takeover
+            response = ['permessage-deflate']
+            try:
+                for param in params[1:]:
+                    name, value = (param.split('=', 1) + [None])[:2]
+                    if value is not None:
+                        value = int(value.strip().strip('"'))
+                    if name == 'server_no_context_takeover':
+                        server_takeover = False
+                    elif name == 'client_no_context_takeover':
+                        client_takeover = False
+                    elif name == 'server_max_window_bits':
+                        server_bits = min(value, window_bits)
+                        response.append('server_max_window_bits={}'.format(
+                            server_bits))
+                    elif name == 'client_max_window_bits':
+                        client_bits = min(value or 15, window_bits)
+                        response.append('client_max_window_bits={}'.format(
+                            client_bits))
+                    else:
+                        raise ValueError(name)
+            except (TypeError, ValueError):
+                continue
+            if server_bits < 9 or (client_bits is None and window_bits < 15):
+                # zlib cannot compress with a window of 256 bytes, and
+                # clients that do not accept a window size use the largest
+                continue
+            if not server_takeover:
+                response.append('server_no_context_takeover')
+            if not client_takeover:
+                response.append('client_no_context_takeover')
+            return cls(server_bits, client_bits or 15, server_takeover,
+                       client_takeover), '; '.join(response)
+        return None, None
+
+    def compress(self, data):
+        """Compress the payload of a message.
+
+        :param data: The payload, given as bytes.
+
+        The return value is the compressed payload, or ``None`` if the
+        payload cannot be compressed and must be sent as is.
+        """
+        if zlib is not None:
+            if self.compressor is None:
+                self.compressor = zlib.compressobj(
+                    zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED,
+                    -self.server_bits)
+            data = self.compressor.compress(data) + \
+                self.compressor.flush(zlib.Z_SYNC_FLUSH)
+            if not self.server_takeover:
+                self.compressor = None
+            return data[:-4]
+        try:  # pragma: no cover
+            buf = io.BytesIO()
+            f = deflate.DeflateIO(buf, deflate.RAW, self.server_bits)
+            f.write(data)
+            f.close()
+        except Exception:  # pragma: no cover
+            # the firmware was built without support for compression
+            return None
+        # the data ends with a final block, which must be followed by an
+        # empty block that is not sent except for its first byte
+        return buf.getvalue() + b'\x00'  # pragma: no cover
+
+    def decompress(self, data, max_length=0):
+        """Decompress the payload of a message.
+
+        :param data: The compressed payload.
+        :param max_length: The maximum size of the decompressed payload, or
+                           0 for no limit.
+        """
+        try:
+            if zlib is not None:
+                d = self.get_decompressor()
+                if max_length:
+                    data = d.decompress(data + self.tail, max_length + 1)
+                else:
+                    data = d.decompress(data + self.tail)
+                self.end_message()
+            else:  # pragma: no cover
+                # an empty final block is added to end the data
+                f = deflate.DeflateIO(
+                    io.BytesIO(data + self.tail + b'\x03\x00'),
+                    deflate.RAW, max(self.client_bits, 9))
+                data = f.read(max_length + 1) if max_length else f.read()
+        except Exception:
+            raise WebSocketError('Invalid compressed data')
+        if max_length and len(data) > max_length:
+            raise WebSocketError('Message too large')
+        return data
+
+    def get_decompressor(self):
+        """Return the ``zlib`` decompressor for the messages sent by the
+        client."""
+        if zlib is None:  # pragma: no cover
+            raise WebSocketError('Compressed messages cannot be streamed')
+        if self.decompressor is None:
+            self.decompressor = zlib.decompressobj(
+                -max(self.client_bits, 9))
+        return self.decompressor
+
+    def end_message(self):
+        """Discard the decompression context at the end of a message, if
+        the client does not keep it."""
+        if not self.client_takeover:
+            self.decompressor = None
+
+
+class SendQueue:
+    """A bounded queue of messages waiting to be written to a WebSocket
+    connection. Instances of this class are returned by
+    :meth:`WebSocket.enable_send_queue`.
+    """
+    DROP_OLDEST = 'drop-oldest'
+    DROP_NEWEST = 'drop-newest'
+    COALESCE_LATEST = 'coalesce-latest'
+
+    def __init__(self, ws, size=8, policy=DROP_OLDEST, high_water=None,
+                 on_high_water=None):
+        if policy not in (self.DROP_OLDEST, self.DROP_NEWEST,
+                          self.COALESCE_LATEST):
+            raise ValueError('Invalid send queue policy')
+        self.ws = ws
+        self.size = size
+        self.policy = policy
+        self.high_water = size if high_water is None else high_water
+        self.on_high_water = on_high_water
+        #: The messages waiting to be written, as ``(key, data, opcode)``
+        #: tuples. An opcode of ``None`` marks data that is an encoded
+        #: frame.
+        self.queue = []
+        #: The largest number of messages that were in the queue.
+        self.max_depth = 0
+        #: The number of messages that were written to the client.
+        self.sent = 0
+        #: The number of messages that were dropped because the queue was
+        #: full.
+        self.dropped = 0
+        #: The number of messages that were replaced by a newer message
+        #: with the same key.
+        self.coalesced = 0
+        #: The exception that stopped the writer task, if any.
+        self.error = None
+        self.above_high_water = False
+        self.writing = False
+        self.event = asyncio.Event()
+        self.empty = asyncio.Event()
+        self.empty.set()
+        self.task = None
+
+    def put(self, data, opcode=None, key=None):
+        """Add a message to the queue.
+
+        :param data: The message, given as a string or bytes.
+        :param opcode: The opcode of the message. If ``None``, the data is
+                       an encoded frame that is written as is.
+        :param key: The key of the message, for the ``COALESCE_LATEST``
+                    policy. Messages without a key are never replaced.
+
+        The return value is ``False`` if the message was dropped.
+        """
+        queue = self.queue
+        if self.policy == self.COALESCE_LATEST and key is not None:
+            for i in range(len(queue)):
+                if queue[i][0] == key:
+                    # the newer message replaces the queued one, and is
+                    # written after the messages that were queued since
+                    queue.pop(i)
+                    self.coalesced += 1
+                    break
+        if len(queue) >= self.size:
+            self.dropped += 1
+            if self.policy == self.DROP_NEWEST:
+                return False
+            # the client is not keeping up, so its oldest message is dropped
+            queue.pop(0)
+        queue.append((key, data, opcode))
+        self.empty.clear()
+        depth = len(queue)
+        if depth > self.max_depth:
+            self.max_depth = depth
+        if depth >= self.high_water and not self.above_high_water:
+            self.above_high_water = True
+            if self.on_high_water:
+                self.on_high_water(self.ws, depth)
+        self.event.set()
+        return True
+
+    def start(self):
+        """Start the writer task, if it is not running already."""
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+        return self.task
+
+    def stop(self):
+        """Stop the writer task. A frame that is being written is completed
+        first, so that the client does not receive a partial frame."""
+        if self.task is not None:
+            if not self.writing:
+                self.task.cancel()
+            self.task = None
+
+    async def drain(self, timeout=None):
+        """Wait until the queued messages are written.
+
+        :param timeout: The maximum number of seconds to wait, or ``None``
+                        to wait until the queue is empty.
+
+        The return value is ``False`` if the timeout expired with messages
+        still in the queue.
+        """
+        if self.task is None:
+            return not self.queue
+        try:
+            await wait_for(self.empty.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def run(self):
+        ws = self.ws
+        try:
+            while True:
+                await self.event.wait()
+                self.event.clear()
+                while self.queue:
+                    _, data, opcode = self.queue.pop(0)
+                    if opcode is not None:
+                        # messages are encoded as they are written, so that
+                        # dropped messages are never compressed
+                        data = ws._frame(opcode, data)
+                    self.writing = True
+                    try:
+                        await ws._write(data)
+                    finally:
+                        self.writing = False
+                    self.sent += 1
+                    if self.task is None:
+                        # stopped while the frame was being written
+                        return
+                self.above_high_water = False
+                self.empty.set()
+        except Exception as exc:
+            # the connection failed, so the client will not receive more
+            # messages
+            self.task = None
+            self.error = exc
+            self.empty.set()
+            self.failed()
+
+    def failed(self):
+        """Called when the writer task stops because of an error."""
+        pass
+
+    def stats(self):
+        """Return a dictionary with the queue depth and counters."""
+        return {'queued': len(self.queue), 'max_depth': self.max_depth,
+                'sent': self.sent, 'dropped': self.dropped,
+                'coalesced': self.coalesced}
+
+
+class Subscriber(SendQueue):
+    """A WebSocket connection subscribed to a :class:`WebSocketHub`.
+
+    :param ws: The WebSocket connection.
+    :param queue_size: The maximum number of messages waiting to be sent.
+    :param hub: The hub the connection is subscribed to.
+    """
+    def __init__(self, ws, queue_size, hub):
+        super().__init__(ws, queue_size)
+        self.hub = hub
+        #: The names of the topics the connection is subscribed to.
+        self.topics = []
+
+    def failed(self):
+        self.hub.unsubscribe(self.ws)
+
+
+class WebSocketHub:
+    """A publish/subscribe hub that broadcasts messages to WebSocket
+    connections.
+
+    :param queue_size: The maximum number of messages that can be waiting to
+                       be sent to each connection. When a slow client has a
+                       full queue, its oldest message is dropped, so that it
+                       does not hold back the other clients.
+
+    Connections subscribe to named topics. A message published to a topic is
+    encoded into a WebSocket frame once, and the same frame is queued for all
+    the subscribers of the topic. Each subscribed connection has a task that
+    writes its queued frames. The frames are not compressed, even for
+    connections that negotiated the ``permessage-deflate`` extension.
+    Example::
+
+        from microdot.websocket import WebSocketHub, with_websocket
+
+        hub = WebSocketHub()
+
+        @app.route('/ws')
+        @with_websocket
+        async def ws(request, ws):
+            hub.subscribe(ws, 'telemetry')
+            try:
+                while True:
+                    await ws.receive()
+            finally:
+                hub.unsubscribe(ws)
+
+        async def telemetry():
+            while True:
+                hub.publish('telemetry', json.dumps(sampler.values()))
+                await asyncio.sleep(0.1)
+    """
+    def __init__(self, queue_size=8):
+        self.queue_size = queue_size
+        #: The subscribers of each topic, indexed by topic name.
+        self.topics = {}
+        #: The subscribers, indexed by WebSocket connection.
+        self.subscribers = {}
+
+    def subscribe(self, ws, *topics):
+        """Subscribe a WebSocket connection to one or more topics.
+
+        :param ws: The WebSocket connection.
+        :param topics: The names of the topics.
+        """
+        subscriber = self.subscribers.get(ws)
+        if subscriber is None:
+            subscriber = Subscriber(ws, self.queue_size, self)
+            subscriber.start()
+            self.subscribers[ws] = subscriber
+        for topic in topics:
+            if topic not in subscriber.topics:
+                subscriber.topics.append(topic)
+                self.topics.setdefault(topic, []).append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, ws, *topics):
+        """Unsubscribe a WebSocket connection from topics.
+
+        :param ws: The WebSocket connection.
+        :param topics: The names of the topics. If not given, the connection
+                       is unsubscribed from all its topics and its sending
+                       task is stopped.
+        """
+        subscriber = self.subscribers.get(ws)
+        if subscriber is None:
+            return
+        for topic in topics or subscriber.topics[:]:
+            if topic in subscriber.topics:
+                subscriber.topics.remove(topic)
+                self.topics[topic].remove(subscriber)
+                if not self.topics[topic]:
+                    del self.topics[topic]
+        if not subscriber.topics:
+            del self.subscribers[ws]
+            subscriber.stop()
+
+    def publish(self, topic, data, opcode=None):
+        """Send a message to all the subscribers of a topic.
+
+        :param topic: The name of the topic.
+        :param data: The message, given as a string or bytes.
+        :param opcode: a custom frame opcode to use. If not given, the opcode
+                       is ``TEXT`` or ``BINARY`` depending on the type of the
+                       data.
+
+        The message is queued for each subscriber and this method returns
+        without waiting for it to be sent. The return value is the number of
+        subscribers the message was queued for.
+
+        The frame is encoded once, so it is never compressed with
+        ``permessage-deflate``, and it bypasses the send queue enabled with
+        :meth:`WebSocket.enable_send_queue`, as each subscriber has its own
+        queue. It is written under the same lock as the other frames of the
+        connection, so it never interleaves with them. Connections that are
+        closed are unsubscribed instead.
+        """
+        subscribers = self.topics.get(topic)
+        if not subscribers:
+            return 0
+        frame = bytes(WebSocket._encode_websocket_frame(
+            opcode or (WebSocket.TEXT if isinstance(data, str)
+                       else WebSocket.BINARY), data))
+        count = 0
+        for subscriber in subscribers[:]:
+            if subscriber.ws.closed:
+                self.unsubscribe(subscriber.ws)
+            else:
+                subscriber.put(frame)
+                count += 1
+        return count
+
+    def stats(self):
+        """Return a list with the address, topics, queue depth and counters
+        of each subscriber."""
+        return [{'client': s.ws.request.client_addr, 'topics': s.topics,
+                 'queued': len(s.queue), 'sent': s.sent,
+                 'dropped': s.dropped}
+                for s in self.subscribers.values()]
 
 
 async def websocket_upgrade(request):
@@ -0,0 +1,20 @@
+# Native code unmasking of WebSocket payloads for MicroPython. It is kept in
+# its own module because ports built without the viper emitter reject the
+# decorator when the module is compiled, which the importer can catch.
+import micropython
+
+
+@micropython.viper
+def xor_mask(buf: ptr8, n: int, mask: ptr8):
+    # XOR 32-bit words in place, then the remaining bytes
+    m = uint(mask[0]) | (uint(mask[1]) << 8) | (uint(mask[2]) << 16) | \
+        (uint(mask[3]) << 24)
+    words = ptr32(buf)
+    i = 0
+    while i < (n >> 2):
+        words[i] ^= m
+        i += 1
+    i = n & ~3
+    while i < n:
+        buf[i] ^= mask[i & 3]
+        i += 1
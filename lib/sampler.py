@@ -0,0 +1,242 @@
+"""
+sampler
+-------
+
+The ``sampler`` module polls sensors from a single background task and keeps
+their latest readings, so that any number of request handlers and WebSocket
+connections can share them without touching the hardware.
+"""
+import asyncio
+
+try:
+    from time import ticks_ms, ticks_diff, ticks_add
+except ImportError:  # pragma: no cover
+    from time import monotonic
+
+    def ticks_ms():
+        return int(monotonic() * 1000)
+
+    def ticks_diff(ticks1, ticks2):
+        return ticks1 - ticks2
+
+    def ticks_add(ticks, delta):
+        return ticks + delta
+
+
+class Sensor:
+    """A sensor registered with a :class:`Sampler`.
+
+    :param name: The name of the sensor.
+    :param read: The function that reads the sensor.
+    :param interval: The number of milliseconds between readings.
+    :param valid: A function that returns ``False`` for readings that should
+                  be discarded.
+    :param own_task: ``True`` if the sensor is read from its own task.
+    """
+    def __init__(self, name, read, interval, valid=None, own_task=False):
+        self.name = name
+        self.read = read
+        self.interval = interval
+        self.valid = valid
+        self.own_task = own_task
+        self.task = None
+        #: The latest valid reading, or ``None`` before the first one.
+        self.value = None
+        #: The ``ticks_ms()`` time of the latest valid reading.
+        self.timestamp = None
+        #: The ``ticks_ms()`` time at which the next reading is due.
+        self.due = ticks_ms()
+        #: The number of valid readings.
+        self.count = 0
+        #: The number of readings that were discarded or raised an error.
+        self.errors = 0
+        #: The exception raised by the latest failed reading, or ``None``.
+        self.last_error = None
+        #: ``True`` while the readings of the sensor raise exceptions.
+        self.failing = False
+
+
+class Sampler:
+    """Poll sensors at their configured rates and publish the latest values.
+
+    Each sensor is read once per interval, regardless of how many clients
+    consume its value. Readings are taken one at a time by a single task,
+    so sensors that can interfere with each other, such as several
+    ultrasonic rangers, never fire at once. A sensor that takes long to
+    read, such as an ultrasonic ranger waiting for its echo, can instead be
+    read from its own task, so that it does not delay the readings of the
+    other sensors. Example::
+
+        from sampler import Sampler
+
+        sampler = Sampler()
+        sampler.add('distance', ultrasonic.distance, 100,
+                    valid=lambda d: d >= 0, own_task=True)
+        sampler.add('potentiometer', potentiometer.read, 50)
+        sampler.start()
+
+        # in a handler
+        payload = json.dumps(sampler.values())
+
+    Read functions can be regular functions or coroutines. A reading of
+    ``None``, a reading rejected by the sensor's ``valid`` function, or a
+    reading that raises an exception is discarded and the previous value is
+    kept. Exceptions are printed when a sensor starts failing or fails with
+    a different error, and the recovery of the sensor is printed as well.
+    """
+    def __init__(self):
+        #: The registered sensors, indexed by name.
+        self.sensors = {}
+        #: A counter that is incremented each time a new reading is
+        #: published. Consumers can compare it against a previous value to
+        #: find out if there is new data.
+        self.seq = 0
+        self.task = None
+
+    def add(self, name, read, interval, valid=None, own_task=False):
+        """Register a sensor.
+
+        :param name: The name of the sensor.
+        :param read: The function that reads the sensor. It can be a regular
+                     function or a coroutine.
+        :param interval: The number of milliseconds between readings.
+        :param valid: A function that receives a reading and returns
+                      ``False`` if it should be discarded.
+        :param own_task: Read the sensor from its own task instead of the
+                         task shared by the other sensors. Use this for
+                         coroutines that wait for the hardware, so that
+                         the other sensors are read while they wait.
+        """
+        sensor = Sensor(name, read, interval, valid=valid, own_task=own_task)
+        self.sensors[name] = sensor
+        if own_task and self.task is not None:
+            sensor.task = asyncio.create_task(self.run_sensor(sensor))
+        return sensor
+
+    def get(self, name, default=None):
+        """Return the latest value of a sensor.
+
+        :param name: The name of the sensor.
+        :param default: The value to return if the sensor has not produced
+                        a valid reading yet.
+        """
+        value = self.sensors[name].value
+        return default if value is None else value
+
+    def reading(self, name):
+        """Return the latest reading of a sensor as a ``(value, timestamp)``
+        tuple, with the timestamp given in ``ticks_ms()`` units.
+
+        :param name: The name of the sensor.
+        """
+        sensor = self.sensors[name]
+        return sensor.value, sensor.timestamp
+
+    def age(self, name):
+        """Return the number of milliseconds since the latest valid reading
+        of a sensor, or ``None`` if there is none.
+
+        :param name: The name of the sensor.
+        """
+        timestamp = self.sensors[name].timestamp
+        return None if timestamp is None \
+            else ticks_diff(ticks_ms(), timestamp)
+
+    def values(self):
+        """Return a dictionary with the latest value of each sensor."""
+        return {name: sensor.value for name, sensor in self.sensors.items()}
+
+    def stats(self):
+        """Return a dictionary with the reading counters of each sensor."""
+        return {name: {'count': sensor.count, 'errors': sensor.errors,
+                       'last_error': None if sensor.last_error is None
+                       else str(sensor.last_error)}
+                for name, sensor in self.sensors.items()}
+
+    def start(self):
+        """Start the sampling tasks, if they are not running already."""
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+            for sensor in self.sensors.values():
+                if sensor.own_task:
+                    sensor.task = asyncio.create_task(
+                        self.run_sensor(sensor))
+        return self.task
+
+    def stop(self):
+        """Stop the sampling tasks."""
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+            for sensor in self.sensors.values():
+                if sensor.task is not None:
+                    sensor.task.cancel()
+                    sensor.task = None
+
+    async def sample(self, sensor):
+        """Take a reading from a sensor and publish it if it is valid.
+
+        :param sensor: The :class:`Sensor` to read.
+        """
+        try:
+            value = sensor.read()
+            if hasattr(value, 'send'):
+                value = await value
+        except Exception as exc:
+            # a disconnected sensor fails at the sampling rate, so only the
+            # first error and changes of error are printed
+            if not sensor.failing or \
+                    str(exc) != str(sensor.last_error):
+                print('Error reading sensor {}: {}'.format(sensor.name, exc))
+            sensor.failing = True
+            sensor.last_error = exc
+            value = None
+        else:
+            if sensor.failing:
+                sensor.failing = False
+                print('Sensor {} recovered'.format(sensor.name))
+        if value is None or (sensor.valid and not sensor.valid(value)):
+            sensor.errors += 1
+            return False
+        sensor.value = value
+        sensor.timestamp = ticks_ms()
+        sensor.count += 1
+        self.seq += 1
+        return True
+
+    async def run(self):
+        while True:
+            # read the sensor that is most overdue
+            now = ticks_ms()
+            sensor = None
+            for s in self.sensors.values():
+                if s.own_task:
+                    continue
+                if sensor is None or ticks_diff(s.due, sensor.due) < 0:
+                    sensor = s
+            if sensor is None:
+                await asyncio.sleep(0.1)
+                continue
+            delay = ticks_diff(sensor.due, now)
+            if delay > 0:
+                await asyncio.sleep(delay / 1000)
+                continue
+            await self.sample(sensor)
+            self._schedule(sensor)
+            await asyncio.sleep(0)
+
+    async def run_sensor(self, sensor):
+        while True:
+            delay = ticks_diff(sensor.due, ticks_ms())
+            if delay > 0:
+                await asyncio.sleep(delay / 1000)
+            await self.sample(sensor)
+            self._schedule(sensor)
+            await asyncio.sleep(0)
+
+    def _schedule(self, sensor):
+        sensor.due = ticks_add(sensor.due, sensor.interval)
+        if ticks_diff(ticks_ms(), sensor.due) > sensor.interval:
+            # the sensor fell behind, so skip the missed readings instead
+            # of reading it several times in a row
+            sensor.due = ticks_add(ticks_ms(), sensor.interval)
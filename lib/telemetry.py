@@ -0,0 +1,241 @@
+"""
+telemetry
+---------
+
+The ``telemetry`` module encodes sensor readings as compact binary messages,
+so that they can be streamed to WebSocket clients without building a JSON
+document for each message, and filters out messages that carry no
+meaningful change. The matching decoder for web pages is in
+``web/telemetry.js``.
+"""
+import json
+import struct
+
+try:
+    from time import ticks_ms, ticks_diff
+except ImportError:  # pragma: no cover
+    from time import monotonic
+
+    def ticks_ms():
+        return int(monotonic() * 1000)
+
+    def ticks_diff(ticks1, ticks2):
+        return ticks1 - ticks2
+
+
+class Telemetry:
+    """Encode sensor readings according to a fixed schema.
+
+    :param fields: The fields of the messages, given as a sequence of
+                   ``(name, format, default)`` tuples. The format is a
+                   ``struct`` format character such as ``'f'`` for a 32-bit
+                   float or ``'h'`` for a 16-bit signed integer. The default
+                   is sent when the field has no value.
+
+    Each binary message starts with a 16-bit sequence number and a 32-bit
+    timestamp in milliseconds, followed by the fields in the order given,
+    all in little-endian byte order and without padding. Messages are
+    encoded into a buffer that is reused for every message, so the buffer
+    must be sent before the next message is encoded. Example::
+
+        from telemetry import Telemetry
+
+        FIELDS = (('distance', 'f', -1.0), ('potentiometer', 'h', -1))
+
+        @app.route('/ws')
+        @with_websocket
+        async def ws(request, ws):
+            telemetry = Telemetry(FIELDS)
+            if request.args.get('format') == 'binary':
+                await ws.send(telemetry.schema())
+                while True:
+                    await ws.send(telemetry.encode(sampler), ws.BINARY)
+                    await asyncio.sleep(0.1)
+            else:
+                while True:
+                    await ws.send(telemetry.encode_json(sampler))
+                    await asyncio.sleep(0.1)
+
+    The schema is sent as a text message before the binary messages, so
+    that the client can decode them. Clients that do not ask for the binary
+    format receive the same readings as JSON.
+    """
+    #: The format of the header of each message, with the sequence number
+    #: and the timestamp.
+    header = '<HI'
+
+    def __init__(self, fields):
+        self.fields = []
+        offset = struct.calcsize(self.header)
+        for name, fmt, default in fields:
+            self.fields.append((name, '<' + fmt, offset, default))
+            offset += struct.calcsize('<' + fmt)
+        #: The size of the binary messages, in bytes.
+        self.size = offset
+        #: The buffer that holds the last encoded message.
+        self.buffer = bytearray(offset)
+        #: The sequence number of the last message, which wraps around
+        #: after 65535. Clients can use it to detect lost messages.
+        self.seq = 0
+
+    def schema(self):
+        """Return the JSON message that describes the binary format."""
+        return json.dumps({'schema': {
+            'header': self.header,
+            'size': self.size,
+            'fields': [[name, fmt[1:], offset]
+                       for name, fmt, offset, _ in self.fields],
+        }})
+
+    def encode(self, values):
+        """Encode a binary message and return the buffer that holds it.
+
+        :param values: The readings, given as a dictionary or any object
+                       with a ``get(name, default)`` method, such as a
+                       :class:`~sampler.Sampler`.
+        """
+        self.seq = (self.seq + 1) & 0xffff
+        buf = self.buffer
+        struct.pack_into(self.header, buf, 0, self.seq,
+                         ticks_ms() & 0xffffffff)
+        for name, fmt, offset, default in self.fields:
+            value = values.get(name, default)
+            struct.pack_into(fmt, buf, offset,
+                             default if value is None else value)
+        return buf
+
+    def encode_json(self, values):
+        """Encode a JSON message with the same contents as :meth:`encode`.
+
+        :param values: The readings, given as a dictionary or any object
+                       with a ``get(name, default)`` method.
+        """
+        self.seq = (self.seq + 1) & 0xffff
+        message = {'seq': self.seq, 't': ticks_ms() & 0xffffffff}
+        for name, _, _, default in self.fields:
+            value = values.get(name, default)
+            message[name] = default if value is None else value
+        return json.dumps(message)
+
+    def decode(self, data):
+        """Decode a binary message into a dictionary.
+
+        :param data: The message, given as bytes.
+        """
+        seq, t = struct.unpack_from(self.header, data, 0)
+        message = {'seq': seq, 't': t}
+        for name, fmt, offset, _ in self.fields:
+            message[name] = struct.unpack_from(fmt, data, offset)[0]
+        return message
+
+
+class ChangeFilter:
+    """Decide when readings have changed enough to be sent to a client.
+
+    :param fields: The fields to watch, given as a sequence of
+                   ``(name, absolute, relative)`` tuples. A field has
+                   changed when its value moves away from the last value
+                   sent by more than the absolute deadband, or by more than
+                   the relative deadband multiplied by the last value,
+                   whichever is larger. Use 0 for both to send any change.
+    :param heartbeat: The maximum number of milliseconds without sending,
+                      after which the readings are sent even if they have
+                      not changed, so that clients know the connection is
+                      alive. Set to 0 to disable the heartbeat.
+    :param min_interval: The minimum number of milliseconds between two
+                         sends, which limits the rate of messages when the
+                         readings change quickly.
+
+    Example::
+
+        from telemetry import ChangeFilter
+
+        DEADBANDS = (('distance', 0.5, 0.01), ('potentiometer', 16, 0))
+
+        @app.route('/ws')
+        @with_websocket
+        async def ws(request, ws):
+            changes = ChangeFilter(DEADBANDS, heartbeat=1000)
+            while True:
+                if changes.check(sampler):
+                    await ws.send(json.dumps(sampler.values()))
+                await asyncio.sleep(0.1)
+
+    Each client should use its own filter, as the filter remembers the
+    values that were sent last.
+    """
+    def __init__(self, fields, heartbeat=1000, min_interval=0):
+        self.fields = tuple(fields)
+        self.heartbeat = heartbeat
+        self.min_interval = min_interval
+        self.last = [None] * len(self.fields)
+        self.last_time = None
+        self.last_seq = None
+        #: The number of checks that allowed the readings to be sent.
+        self.sent = 0
+        #: The number of checks that suppressed the readings.
+        self.suppressed = 0
+
+    def reset(self):
+        """Forget the last values sent, so that the next check sends."""
+        self.last = [None] * len(self.fields)
+        self.last_time = None
+        self.last_seq = None
+
+    def changed(self, values):
+        """Return ``True`` if any field has moved out of its deadband.
+
+        :param values: The readings, given as a dictionary or any object
+                       with a ``get(name, default)`` method, such as a
+                       :class:`~sampler.Sampler`.
+        """
+        seq = getattr(values, 'seq', None)
+        if seq is not None and seq == self.last_seq:
+            # the sampler has not published a new reading
+            return False
+        last = self.last
+        for i, (name, absolute, relative) in enumerate(self.fields):
+            value = values.get(name, None)
+            previous = last[i]
+            if value is None or previous is None:
+                if value is not previous:
+                    return True
+            elif abs(value - previous) > max(absolute,
+                                             abs(previous) * relative):
+                return True
+        return False
+
+    def check(self, values):
+        """Return ``True`` if the readings should be sent now.
+
+        :param values: The readings, given as a dictionary or any object
+                       with a ``get(name, default)`` method.
+
+        The readings are sent when they have changed or the heartbeat
+        interval has passed, but never sooner than ``min_interval`` after
+        the previous send. When this method returns ``True``, the readings
+        are remembered as the last values sent.
+        """
+        now = ticks_ms()
+        if self.last_time is None:
+            send = True
+        else:
+            elapsed = ticks_diff(now, self.last_time)
+            if elapsed < self.min_interval:
+                send = False
+            else:
+                send = (self.heartbeat and elapsed >= self.heartbeat) or \
+                    self.changed(values)
+        if not send:
+            self.suppressed += 1
+            return False
+        for i, (name, _, _) in enumerate(self.fields):
+            self.last[i] = values.get(name, None)
+        self.last_time = now
+        self.last_seq = getattr(values, 'seq', None)
+        self.sent += 1
+        return True
+
+    def stats(self):
+        """Return a dictionary with the sent and suppressed counters."""
+        return {'sent': self.sent, 'suppressed': self.suppressed}
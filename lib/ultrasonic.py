@@ -0,0 +1,235 @@
+"""
+ultrasonic
+----------
+
+The ``ultrasonic`` module implements a non-blocking driver for HC-SR04 style
+ultrasonic rangers. The echo pulse is timed with pin interrupts, so that the
+asyncio loop keeps running while the sensor waits for the echo.
+"""
+import asyncio
+
+try:
+    from time import ticks_us, ticks_diff, sleep_us
+except ImportError:  # pragma: no cover
+    from time import perf_counter_ns
+
+    def ticks_us():
+        return perf_counter_ns() // 1000
+
+    def ticks_diff(ticks1, ticks2):
+        return ticks1 - ticks2
+
+    def sleep_us(us):
+        pass
+
+try:
+    from machine import Pin
+    IRQ_BOTH = Pin.IRQ_RISING | Pin.IRQ_FALLING
+except ImportError:  # pragma: no cover
+    IRQ_BOTH = 3
+
+try:
+    ThreadSafeFlag = asyncio.ThreadSafeFlag
+except AttributeError:  # pragma: no cover
+    class ThreadSafeFlag:
+        """Minimal replacement for MicroPython's ``asyncio.ThreadSafeFlag``,
+        for use with simulated pins."""
+        def __init__(self):
+            self.event = asyncio.Event()
+
+        def set(self):
+            self.event.set()
+
+        def clear(self):
+            self.event.clear()
+
+        async def wait(self):
+            await self.event.wait()
+            self.event.clear()
+
+
+class Ultrasonic:
+    """Interrupt-driven driver for an ultrasonic ranger.
+
+    :param trigger: The output pin connected to the sensor's trigger input.
+    :param echo: The input pin connected to the sensor's echo output.
+    :param timeout_us: The longest echo pulse that is accepted, in
+                       microseconds. Longer pulses, or no pulse at all, are
+                       reported as a failed reading.
+    :param ticks_us: The function that returns the time of the echo edges.
+                     Only needs to be given with simulated pins.
+
+    The trigger pulse is sent and the task waits on a flag that the echo pin
+    interrupt handler sets when the falling edge of the echo arrives, so
+    other tasks can run while the sound travels. The handler is registered
+    as a hard interrupt, so that the edges are timed when they happen and
+    not when the scheduler gets to run the handler. Example::
+
+        from machine import Pin
+        from ultrasonic import Ultrasonic
+
+        sensor = Ultrasonic(Pin(27, Pin.OUT), Pin(13, Pin.IN))
+
+        async def main():
+            print(await sensor.distance(samples=3))
+    """
+    #: The number of microseconds sound takes to travel 1 cm and back,
+    #: divided by two.
+    us_per_cm = 29.1
+
+    #: The number of seconds to wait between the pings of a burst, so that
+    #: echoes of the previous ping fade out.
+    burst_interval = 0.01
+
+    #: The number of seconds the echo pulse is allowed to start after the
+    #: trigger. HC-SR04 sensors start the pulse about 0.5 ms after it.
+    echo_delay = 0.005
+
+    def __init__(self, trigger, echo, timeout_us=30000, ticks_us=ticks_us):
+        self.trigger = trigger
+        self.echo = echo
+        self.timeout_us = timeout_us
+        self.ticks_us = ticks_us
+        self.flag = ThreadSafeFlag()
+        self.rise = None
+        self.fall = None
+        #: The number of pings sent.
+        self.pings = 0
+        #: The number of pings that did not produce a valid echo.
+        self.timeouts = 0
+        self.trigger.value(0)
+        self.echo.irq(handler=self._irq, trigger=IRQ_BOTH, hard=True)
+
+    def _irq(self, pin):
+        # take the time first, and tell the edges apart by their order, as
+        # the level of the pin may have changed again for a short echo
+        t = self.ticks_us()
+        if self.rise is None:
+            self.rise = t
+        elif self.fall is None:
+            self.fall = t
+            self.flag.set()
+
+    async def ping(self):
+        """Send a ping and return the length of the echo pulse in
+        microseconds, or ``None`` if no valid echo was received."""
+        self.rise = None
+        self.fall = None
+        self.flag.clear()
+        self.pings += 1
+        self.trigger.value(1)
+        sleep_us(10)
+        self.trigger.value(0)
+        try:
+            await asyncio.wait_for(
+                self.flag.wait(),
+                self.timeout_us / 1000000 + self.echo_delay)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            return None
+        pulse = ticks_diff(self.fall, self.rise)
+        if pulse <= 0 or pulse > self.timeout_us:
+            self.timeouts += 1
+            return None
+        return pulse
+
+    async def distance(self, samples=1):
+        """Measure the distance to the nearest object, in centimeters.
+
+        :param samples: The number of pings to send. The median of the valid
+                        echoes is used, which discards spurious readings.
+
+        ``None`` is returned when none of the pings received a valid echo.
+        """
+        pulses = []
+        for i in range(samples):
+            if i:
+                await asyncio.sleep(self.burst_interval)
+            pulse = await self.ping()
+            if pulse is not None:
+                pulses.append(pulse)
+        if not pulses:
+            return None
+        pulses.sort()
+        n = len(pulses)
+        pulse = pulses[n // 2] if n % 2 else \
+            (pulses[n // 2 - 1] + pulses[n // 2]) / 2
+        return pulse / 2 / self.us_per_cm
+
+
+class SimulatedSensor:
+    """A simulated ultrasonic sensor, for testing and benchmarking the
+    driver without hardware.
+
+    :param distance: The distance to report, in centimeters, or ``None`` to
+                     simulate a missing echo. It can also be a function that
+                     is called on each ping.
+    :param echo_delay_us: The delay between the trigger and the start of the
+                          echo pulse.
+
+    The ``trigger`` and ``echo`` attributes are pin objects to pass to
+    :class:`Ultrasonic`, together with the ``ticks_us`` method, which
+    reports the simulated time of the echo edges. The edges are delivered
+    from a task after sleeping for the duration of the pulse, so they arrive
+    asynchronously as they would on a real sensor. Example::
+
+        sim = SimulatedSensor(distance=50)
+        sensor = Ultrasonic(sim.trigger, sim.echo, ticks_us=sim.ticks_us)
+    """
+    def __init__(self, distance=100.0, echo_delay_us=450):
+        self.distance = distance
+        self.echo_delay_us = echo_delay_us
+        self.trigger = SimulatedPin(on_change=self._trigger)
+        self.echo = SimulatedPin()
+        self.time = 0
+        self.triggered = False
+
+    def ticks_us(self):
+        return self.time
+
+    def _trigger(self, value):
+        if value:
+            self.triggered = True
+        elif self.triggered:
+            # falling edge of the trigger pulse, ignoring the pin being set
+            # low when the driver is initialized
+            self.triggered = False
+            distance = self.distance() if callable(self.distance) \
+                else self.distance
+            asyncio.create_task(self._echo(ticks_us(), distance))
+
+    async def _echo(self, start, distance):
+        if distance is None:
+            return
+        pulse = int(distance * 2 * Ultrasonic.us_per_cm)
+        await asyncio.sleep(self.echo_delay_us / 1000000)
+        self.time = start + self.echo_delay_us
+        self.echo.set(1)
+        await asyncio.sleep(pulse / 1000000)
+        self.time += pulse
+        self.echo.set(0)
+
+
+class SimulatedPin:
+    """A pin that can be driven by code, with support for interrupt
+    handlers."""
+    def __init__(self, value=0, on_change=None):
+        self._value = value
+        self.on_change = on_change
+        self.handler = None
+
+    def value(self, value=None):
+        if value is None:
+            return self._value
+        self._value = value
+        if self.on_change:
+            self.on_change(value)
+
+    def irq(self, handler=None, trigger=IRQ_BOTH, hard=False):
+        self.handler = handler
+
+    def set(self, value):
+        """Change the level of the pin and invoke the interrupt handler."""
+        self._value = value
+        if self.handler:
+            self.handler(self)
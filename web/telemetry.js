@@ -0,0 +1,67 @@
+// 二進位遙測解碼器：對應 lib/telemetry.py 的 Telemetry 類別
+//
+// 使用方式：
+//   <script src="telemetry.js"></script>
+//   const telemetry = new TelemetryDecoder();
+//   const ws = new WebSocket(telemetryUrl('/ws'));
+//   ws.binaryType = 'arraybuffer';
+//   ws.onmessage = (event) => {
+//       const data = telemetry.decode(event.data);
+//       if (data) { ... data.distance, data.potentiometer ... }
+//   };
+//
+// 伺服器會先以文字訊息傳送欄位格式 (schema)，之後每筆數據都是固定長度的
+// 二進位訊息。若伺服器傳送的是 JSON 文字訊息，也會直接解析後回傳。
+
+// struct 格式字元對應的 DataView 讀取方法
+const TELEMETRY_READERS = {
+    b: 'getInt8', B: 'getUint8',
+    h: 'getInt16', H: 'getUint16',
+    i: 'getInt32', I: 'getUint32',
+    l: 'getInt32', L: 'getUint32',
+    f: 'getFloat32', d: 'getFloat64',
+};
+
+// 取得要求二進位格式的 WebSocket 網址
+function telemetryUrl(path) {
+    return `ws://${window.location.host}${path}?format=binary`;
+}
+
+class TelemetryDecoder {
+    constructor() {
+        this.fields = null;
+        this.size = 0;
+        // 因序號不連續而推算出的遺失訊息數
+        this.lost = 0;
+        this.seq = null;
+    }
+
+    // 解碼一則訊息，回傳數據物件；收到 schema 或無法解碼時回傳 null
+    decode(data) {
+        if (typeof data === 'string') {
+            const message = JSON.parse(data);
+            if (message.schema) {
+                this.fields = message.schema.fields.map(([name, fmt, offset]) => (
+                    { name, reader: TELEMETRY_READERS[fmt], offset }
+                ));
+                this.size = message.schema.size;
+                this.seq = null;
+                return null;
+            }
+            return message;
+        }
+        if (!this.fields || data.byteLength < this.size) {
+            return null;
+        }
+        const view = new DataView(data);
+        const message = { seq: view.getUint16(0, true), t: view.getUint32(2, true) };
+        if (this.seq !== null) {
+            this.lost += (message.seq - this.seq - 1 + 65536) % 65536;
+        }
+        this.seq = message.seq;
+        for (const field of this.fields) {
+            message[field.name] = view[field.reader](field.offset, true);
+        }
+        return message;
+    }
+}